@@ -0,0 +1,117 @@
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_message(message: str) -> str:
+    return _WS_RE.sub(" ", message).strip().lower().rstrip("?!. ")
+
+
+class AnswerCache:
+    """Per-user cache of agent answers keyed on conversation and normalized message text, with single-flight coalescing."""
+
+    def __init__(self, ttl=300.0, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._answers = OrderedDict()
+        self._generations = {}
+        self._data_versions = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.upstream_calls = 0
+        self.upstream_seconds = 0.0
+        self._upstream_recent = deque(maxlen=1000)
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._answers.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._answers[key]
+                return None
+            self._answers.move_to_end(key)
+            return entry[1]
+
+    def _put(self, key, answer, generation):
+        with self._lock:
+            # Skip answers computed before the user's data changed
+            if self._generations.get(key[0], 0) != generation:
+                return
+            self._answers[key] = (time.monotonic() + self.ttl, answer)
+            self._answers.move_to_end(key)
+            while len(self._answers) > self.maxsize:
+                self._answers.popitem(last=False)
+
+    def invalidate_user(self, username: str):
+        with self._lock:
+            self._generations[username] = self._generations.get(username, 0) + 1
+            for key in [key for key in self._answers if key[0] == username]:
+                del self._answers[key]
+
+    def observe_data_version(self, username: str, version: int):
+        """Invalidates the user when their shared data version moved, e.g. after an ingest in another worker."""
+        with self._lock:
+            seen = self._data_versions.get(username)
+            self._data_versions[username] = version
+        if seen is not None and seen != version:
+            self.invalidate_user(username)
+
+    def record_upstream(self, seconds: float):
+        self.upstream_calls += 1
+        self.upstream_seconds += seconds
+        self._upstream_recent.append(seconds)
+
+    async def _fetch_and_store(self, key, fetch):
+        with self._lock:
+            generation = self._generations.get(key[0], 0)
+        answer, cacheable = await fetch()
+        if cacheable and self.ttl > 0:
+            self._put(key, answer, generation)
+        return answer
+
+    async def get_or_fetch(self, username: str, message: str, fetch, context=None):
+        """fetch() is an async callable returning (answer, cacheable); context (e.g. a conversation id) scopes the entry."""
+        key = (username, context, normalize_message(message))
+        answer = self._get(key)
+        if answer is not None:
+            self.hits += 1
+            return answer
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fetch_and_store(key, fetch))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shield so one caller disconnecting does not cancel the shared upstream call
+        return await asyncio.shield(task)
+
+    def metrics(self):
+        requests = self.hits + self.misses + self.coalesced
+        recent = sorted(self._upstream_recent)
+
+        def pct(p):
+            return round(recent[min(len(recent) - 1, int(p * len(recent)))], 4) if recent else None
+
+        return {
+            "requests": requests,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.coalesced) / requests, 4) if requests else 0.0,
+            "cached_answers": len(self._answers),
+            "inflight": len(self._inflight),
+            "upstream_calls": self.upstream_calls,
+            "upstream_avg_seconds": round(self.upstream_seconds / self.upstream_calls, 4) if self.upstream_calls else None,
+            "upstream_p50_seconds": pct(0.5),
+            "upstream_p95_seconds": pct(0.95),
+        }
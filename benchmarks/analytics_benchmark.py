@@ -0,0 +1,123 @@
+"""
+Compares the local analytics engine with ES|QL on generated datasets.
+
+Generates transactions for alice/bob/charlie with generate_user_data.py, loads
+them into a throwaway LocalTransactionStore and, when Elasticsearch is
+configured (ELASTIC_URL or ELASTIC_CLOUD_ID), into fincontext-transactions
+under unique benchmark user ids. Each query shape is checked for identical
+results and timed locally and remotely. Benchmark docs are deleted afterwards.
+
+Usage: python benchmarks/analytics_benchmark.py [--iterations 50]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from generate_user_data import generate_transactions
+from local_analytics import LocalTransactionStore, AnalyticsEngine, QUERY_TYPES, TRANSACTIONS_INDEX
+
+USERS = ["alice", "bob", "charlie"]
+PARAMS = {"threshold": 1000, "limit": 5, "merchant": "Zomato"}
+
+
+def normalize(rows):
+    return [
+        {key: round(float(value), 2) if isinstance(value, (int, float)) and key != "count" else value
+         for key, value in row.items()}
+        for row in rows
+    ]
+
+
+def timed(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+async def timed_async(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+async def run(iterations):
+    workdir = tempfile.mkdtemp(prefix="fincontext-analytics-")
+    store = LocalTransactionStore(os.path.join(workdir, "store"))
+    engine = AnalyticsEngine(store)
+    run_id = uuid.uuid4().hex[:8]
+    user_ids = {user: f"analytics-bench-{run_id}-{user}" for user in USERS}
+    csv_paths = {}
+
+    for user in USERS:
+        csv_paths[user] = os.path.join(workdir, f"{user}.csv")
+        generate_transactions(user, csv_paths[user])
+        df = pd.read_csv(csv_paths[user])
+        df["Date"] = pd.to_datetime(df["Date"])
+        store.append(user_ids[user], df)
+        store.mark_complete(user_ids[user])
+
+    es = None
+    if os.getenv("ELASTIC_URL") or os.getenv("ELASTIC_CLOUD_ID"):
+        from ingest_to_elastic import ingest_structured_data
+        from storage import ElasticsearchStorage
+        storage = ElasticsearchStorage()
+        for user in USERS:
+            ingest_structured_data(csv_paths[user], TRANSACTIONS_INDEX, user_id=user_ids[user], storage=storage)
+        storage.refresh(TRANSACTIONS_INDEX)
+        storage.close()
+        es = storage.async_client
+    else:
+        print("Elasticsearch not configured; reporting local latency only.")
+
+    mismatches = 0
+    try:
+        for query_type in QUERY_TYPES:
+            user_id = user_ids[USERS[0]]
+            local_ms = timed(lambda: engine.query_local(query_type, user_id, **PARAMS), iterations)
+            line = f"{query_type:>9}: local {local_ms:8.3f}ms"
+            if es is not None:
+                remote_ms = await timed_async(lambda: engine.query_remote(es, query_type, user_id, **PARAMS), iterations)
+                line += f"  remote {remote_ms:8.3f}ms  ({remote_ms / local_ms:.0f}x)"
+                for user in USERS:
+                    local = normalize(engine.query_local(query_type, user_ids[user], **PARAMS))
+                    remote = normalize(await engine.query_remote(es, query_type, user_ids[user], **PARAMS))
+                    if local != remote:
+                        mismatches += 1
+                        print(f"MISMATCH {query_type} for {user}:\n  local  {local}\n  remote {remote}")
+            print(line)
+    finally:
+        if es is not None:
+            await es.delete_by_query(
+                index=TRANSACTIONS_INDEX,
+                query={"terms": {"user_id": list(user_ids.values())}},
+                refresh=True
+            )
+            await es.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if es is not None:
+        print("PASS: local results match ES|QL" if not mismatches else f"FAIL: {mismatches} mismatches")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(run(args.iterations)))
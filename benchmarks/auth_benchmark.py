@@ -0,0 +1,60 @@
+"""
+Microbenchmark of get_current_user with and without the verified-token cache.
+
+Runs against an in-memory SQLite database, so fincontext.db is untouched.
+
+Usage: python benchmarks/auth_benchmark.py [--iterations 5000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlmodel import SQLModel, Session, create_engine
+from sqlalchemy.pool import StaticPool
+
+import main
+from auth_utils import create_access_token
+from models import User
+
+
+def bench(engine, token, iterations):
+    async def run():
+        with Session(engine) as session:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                await main.get_current_user(token=token, session=session)
+            return time.perf_counter() - start
+    return asyncio.run(run())
+
+
+def report(label, elapsed, iterations):
+    print(f"{label:>10}: {iterations / elapsed:10.0f} calls/s, {elapsed / iterations * 1e6:8.1f} us/call")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(User(username="bench", email="bench@example.com", hashed_password="x"))
+        session.commit()
+    token = create_access_token({"sub": "bench"}, expires_delta=timedelta(hours=1))
+
+    cache_size = main.token_cache.maxsize
+    main.token_cache.maxsize = 0
+    uncached = bench(engine, token, args.iterations)
+    main.token_cache.maxsize = cache_size
+    main.token_cache.clear()
+    cached = bench(engine, token, args.iterations)
+
+    report("uncached", uncached, args.iterations)
+    report("cached", cached, args.iterations)
+    print(f"speedup: {uncached / cached:.1f}x")
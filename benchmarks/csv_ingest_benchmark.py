@@ -0,0 +1,117 @@
+"""
+Rows/sec of the /upload CSV ingest: the typed fast path vs the generic pandas path.
+
+Generates one user's statement with generate_load_data.py, then runs
+ingest_structured_data both ways against an Elasticsearch stub (a separate
+process that acknowledges every bulk item), so the numbers include the
+client's request encoding but no cluster work. parse = reading, validating
+and building bulk actions; total = parse plus bulk round trips.
+
+Usage: python benchmarks/csv_ingest_benchmark.py [--rows 200000] [--runs 3]
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate_load_data import COLUMNS, generate_batch
+
+ITEM = b'{"update":{"status":201,"result":"created"}}'
+
+
+class BulkStub(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; without this each response waits on a delayed ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, body: bytes):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply(b'{"version":{"number":"9.0.0"},"tagline":"You Know, for Search"}')
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        # Every update action is followed by its source line
+        items = b",".join([ITEM] * (body.count(b"\n") // 2))
+        self._reply(b'{"took":1,"errors":false,"items":[' + items + b"]}")
+
+    do_PUT = do_POST
+
+
+def serve_stub(port):
+    ThreadingHTTPServer(("127.0.0.1", port), BulkStub).serve_forever()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    port = free_port()
+    stub = multiprocessing.Process(target=serve_stub, args=(port,), daemon=True)
+    stub.start()
+
+    from elasticsearch import Elasticsearch
+    from storage import ElasticsearchStorage
+    from ingest_to_elastic import ingest_structured_data
+
+    workdir = tempfile.mkdtemp(prefix="fincontext-csv-bench-")
+    try:
+        path = os.path.join(workdir, "transactions.csv")
+        generate_batch(0, 0, 0, 1, args.rows, end_date=date(2025, 1, 1), days=3650)[COLUMNS].to_csv(path, index=False)
+        storage = ElasticsearchStorage(client=Elasticsearch(hosts=[f"http://127.0.0.1:{port}"]))
+        time.sleep(0.5)
+
+        results = {}
+        for label, fast_path in (("generic", False), ("fast", True)):
+            totals, parses, rows = [], [], 0
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                report = ingest_structured_data(path, "bench", user_id="bench", storage=storage,
+                                                chunk_size=args.chunk_size, fast_path=fast_path)
+                totals.append(time.perf_counter() - start)
+                parses.append(report["parse_seconds"])
+                rows = report["new"]
+            results[label] = (statistics.median(totals), statistics.median(parses), rows)
+        storage.close()
+    finally:
+        stub.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{args.rows} rows (distinct after in-file dedupe: {results['fast'][2]}), median of {args.runs} runs")
+    for label, (total, parse, rows) in results.items():
+        print(f"{label:>8}: total {total:6.2f}s {rows / total:10,.0f} rows/s   parse {parse:6.2f}s {rows / parse:10,.0f} rows/s")
+    print(f"speedup: total {results['generic'][0] / results['fast'][0]:.2f}x, parse {results['generic'][1] / results['fast'][1]:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Signup/login throughput against the app database, SQLite defaults vs the tuned engine.
+
+Runs --processes worker processes (like uvicorn workers), each with --threads
+threads (like FastAPI's threadpool), against a fresh SQLite file per mode.
+Every operation is the database work of an endpoint: a signup looks up the
+username, inserts the user and commits; a login looks a seeded user up by
+username. --signup-ratio sets the share of signups in the mix. Password
+hashing is left out so the numbers show the database layer alone (see
+login_benchmark.py for hashing). Pass --url to run the tuned mode against
+another database (e.g. PostgreSQL) instead.
+
+Usage: python benchmarks/db_concurrency_benchmark.py [--processes 4] [--threads 8] [--ops 500]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlmodel import SQLModel, Session, select
+
+from database import create_db_engine
+from models import User
+
+SEED_USERS = 1000
+# Stands in for a real hash; the benchmark measures database time only
+HASHED_PASSWORD = "$pbkdf2-sha256$29000$" + "x" * 64
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))] if values else 0.0
+
+
+def seed(url, tuned):
+    engine = create_db_engine(url, tuned=tuned)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        if session.exec(select(User).where(User.username == "seed0")).first() is None:
+            for i in range(SEED_USERS):
+                session.add(User(username=f"seed{i}", email=f"seed{i}@example.com", hashed_password=HASHED_PASSWORD))
+            session.commit()
+    engine.dispose()
+
+
+def signup(engine, username):
+    with Session(engine) as session:
+        if session.exec(select(User).where(User.username == username)).first():
+            raise RuntimeError("duplicate username")
+        session.add(User(username=username, email=f"{username}@example.com", hashed_password=HASHED_PASSWORD))
+        session.commit()
+
+
+def login(engine, username):
+    with Session(engine) as session:
+        if session.exec(select(User).where(User.username == username)).first() is None:
+            raise RuntimeError("user not found")
+
+
+def run_process(url, tuned, process_index, threads, ops, signup_ratio, start_at):
+    engine = create_db_engine(url, tuned=tuned)
+    signup_every = round(1 / signup_ratio) if signup_ratio > 0 else 0
+
+    def thread_ops(thread_index):
+        results = {"signup": [], "login": [], "errors": {}}
+        for i in range(ops):
+            is_signup = signup_every and i % signup_every == 0
+            start = time.perf_counter()
+            try:
+                if is_signup:
+                    signup(engine, f"p{process_index}t{thread_index}-{uuid.uuid4().hex[:8]}")
+                else:
+                    login(engine, f"seed{(process_index * 7919 + thread_index * 104729 + i) % SEED_USERS}")
+                results["signup" if is_signup else "login"].append(time.perf_counter() - start)
+            except Exception as e:
+                name = type(e).__name__
+                results["errors"][name] = results["errors"].get(name, 0) + 1
+        return results
+
+    time.sleep(max(0.0, start_at - time.time()))
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        per_thread = list(pool.map(thread_ops, range(threads)))
+    engine.dispose()
+    return per_thread
+
+
+def run_mode(label, url, tuned, args):
+    seed(url, tuned)
+    start_at = time.time() + 1.0
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        futures = [
+            pool.submit(run_process, url, tuned, p, args.threads, args.ops, args.signup_ratio, start_at)
+            for p in range(args.processes)
+        ]
+        per_thread = [result for future in futures for result in future.result()]
+    elapsed = time.time() - start_at
+
+    signups = [s for r in per_thread for s in r["signup"]]
+    logins = [s for r in per_thread for s in r["login"]]
+    errors = {}
+    for r in per_thread:
+        for name, count in r["errors"].items():
+            errors[name] = errors.get(name, 0) + count
+
+    print(f"{label}: {args.processes} processes x {args.threads} threads, {elapsed:.2f}s")
+    for name, latencies in (("signup", signups), ("login", logins)):
+        print(f"  {name:>6}: {len(latencies):6d} ok  {len(latencies) / elapsed:8.0f}/s  "
+              f"p50 {percentile(latencies, 50) * 1000:7.2f}ms  p99 {percentile(latencies, 99) * 1000:7.2f}ms")
+    print(f"  errors: {sum(errors.values())} {errors if errors else ''}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=500, help="operations per thread")
+    parser.add_argument("--signup-ratio", type=float, default=0.2, help="share of operations that are signups")
+    parser.add_argument("--url", help="database URL for the tuned run instead of a temporary SQLite file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="fincontext-db-bench-")
+    try:
+        run_mode("SQLite defaults", f"sqlite:///{os.path.join(workdir, 'default.db')}", False, args)
+        run_mode("Tuned", args.url or f"sqlite:///{os.path.join(workdir, 'tuned.db')}", True, args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
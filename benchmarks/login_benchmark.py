@@ -0,0 +1,87 @@
+"""
+Login latency under a burst of concurrent logins.
+
+Fires --concurrency simultaneous POST /token requests (repeated --rounds times)
+while probing GET /users/me, and reports p50/p99 for both. The /users/me
+numbers show whether password hashing is stalling the event loop.
+Runs in-process against an in-memory SQLite database.
+
+Usage: python benchmarks/login_benchmark.py [--concurrency 20] [--rounds 5]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from sqlmodel import SQLModel, Session, create_engine
+from sqlalchemy.pool import StaticPool
+
+import main
+from auth_utils import create_access_token, get_password_hash, PASSWORD_HASH_ROUNDS, PASSWORD_HASH_WORKERS
+from models import User
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summary(label, latencies):
+    print(f"{label:>10}: n={len(latencies):<5} p50 {percentile(latencies, 50) * 1000:8.1f}ms  "
+          f"p99 {percentile(latencies, 99) * 1000:8.1f}ms")
+
+
+async def run(concurrency, rounds):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(User(username="bench", email="bench@example.com", hashed_password=get_password_hash("secret")))
+        session.commit()
+
+    def get_session():
+        with Session(engine) as session:
+            yield session
+
+    main.app.dependency_overrides[main.get_session] = get_session
+    token = create_access_token({"sub": "bench"}, expires_delta=timedelta(hours=1))
+    login_latencies, probe_latencies = [], []
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://app") as client:
+        async def login():
+            start = time.perf_counter()
+            resp = await client.post("/token", data={"username": "bench", "password": "secret"})
+            resp.raise_for_status()
+            login_latencies.append(time.perf_counter() - start)
+
+        async def probe(stop):
+            while not stop.is_set():
+                start = time.perf_counter()
+                resp = await client.get("/users/me", headers={"Authorization": f"Bearer {token}"})
+                resp.raise_for_status()
+                probe_latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.005)
+
+        for _ in range(rounds):
+            stop = asyncio.Event()
+            probe_task = asyncio.create_task(probe(stop))
+            await asyncio.gather(*(login() for _ in range(concurrency)))
+            stop.set()
+            await probe_task
+
+    print(f"pbkdf2_sha256 rounds={PASSWORD_HASH_ROUNDS}, hash workers={PASSWORD_HASH_WORKERS}, "
+          f"concurrency={concurrency}")
+    summary("/token", login_latencies)
+    summary("/users/me", probe_latencies)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.concurrency, args.rounds))
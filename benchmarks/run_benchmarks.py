@@ -0,0 +1,259 @@
+"""
+Benchmark suite for the API hot paths: signup/login, /users/me, /upload
+ingestion, /stats, /analytics, /transactions export and /chat.
+
+The app runs in-process (ASGI transport) or under uvicorn, with the storage
+backend of your choice (in-memory SQLite by default) and a stub Kibana agent
+server. Users, accounts and CSV statements are generated with
+generate_dummy_data.py at the requested size. Results are written as JSON so
+runs can be diffed between commits.
+
+Usage:
+    python benchmarks/run_benchmarks.py --users 20 --rows-per-user 2000 \\
+        --requests 500 --concurrency 20 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aiohttp import web
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed > 0 else None,
+        "mean_ms": ms(statistics.fmean(latencies)) if latencies else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+    }
+
+
+async def measure(make_request, total, concurrency):
+    """Runs make_request(i) total times with at most `concurrency` in flight."""
+    latencies, errors = [], 0
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index, errors
+        while next_index < total:
+            i = next_index
+            next_index += 1
+            start = time.perf_counter()
+            try:
+                resp = await make_request(i)
+                ok = resp.status_code < 400
+            except Exception:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, total))))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def start_agent_stub(delay):
+    async def converse(request):
+        body = await request.json()
+        await asyncio.sleep(delay)
+        return web.json_response({"conversation_id": "bench", "response": {"message": f"echo: {body.get('input', '')[:40]}"}})
+
+    app = web.Application()
+    app.router.add_post("/api/agent_builder/converse", converse)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="fincontext-bench-")
+    agent_runner, agent_url = await start_agent_stub(args.agent_delay)
+    os.environ.update({
+        "STORAGE_BACKEND": args.storage,
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "ANALYTICS_DIR": os.path.join(workdir, "analytics"),
+        "KIBANA_ENDPOINT": agent_url,
+        "ELASTIC_ENDPOINT": "",
+    })
+    if not args.cache:
+        os.environ.update({"STATS_CACHE_TTL": "0", "CHAT_CACHE_TTL": "0", "TOKEN_CACHE_SIZE": "0"})
+    if not args.rate_limits:
+        # A few users sending hundreds of requests would otherwise measure mostly 429s
+        os.environ.update({
+            "CHAT_RATE_PER_MINUTE": "0", "UPLOAD_RATE_PER_MINUTE": "0",
+            "UPLOAD_MAX_PENDING_PER_USER": "0", "INGEST_MAX_PENDING": "0", "AGENT_MAX_CONCURRENCY": "0",
+        })
+
+    import httpx
+    from database import create_db_engine
+    from generate_dummy_data import generate_bank_transactions
+    import main
+
+    # Keep benchmark users and jobs out of fincontext.db
+    main.engine = create_db_engine(f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    main.job_queue.engine = main.engine
+    main.rollups.engine = main.engine
+
+    server_task = None
+    if args.transport == "uvicorn":
+        import uvicorn
+        server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=args.port, log_level="warning"))
+        server_task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.05)
+        client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=None,
+                                   limits=httpx.Limits(max_connections=args.concurrency))
+    else:
+        await main.on_startup()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://app", timeout=None)
+
+    results = {}
+    users = [f"bench{i}" for i in range(args.users)]
+    try:
+        results["POST /signup"] = await measure(
+            lambda i: client.post("/signup", json={"username": users[i], "email": f"{users[i]}@example.com", "password": "secret"}),
+            len(users), args.concurrency
+        )
+        tokens = {}
+
+        async def login(i):
+            resp = await client.post("/token", data={"username": users[i % len(users)], "password": "secret"})
+            if resp.status_code == 200:
+                tokens[users[i % len(users)]] = resp.json()["access_token"]
+            return resp
+
+        results["POST /token"] = await measure(login, max(len(users), args.requests // 10), args.concurrency)
+        auth = lambda i: {"Authorization": f"Bearer {tokens[users[i % len(users)]]}"}
+
+        results["GET /users/me"] = await measure(lambda i: client.get("/users/me", headers=auth(i)), args.requests, args.concurrency)
+
+        csv_paths = []
+        for user in users:
+            path = os.path.join(workdir, f"{user}.csv")
+            generate_bank_transactions(path, num_rows=args.rows_per_user)
+            csv_paths.append(path)
+
+        job_ids = []
+
+        async def upload(i):
+            with open(csv_paths[i], "rb") as f:
+                resp = await client.post("/upload", headers=auth(i), files={"file": ("statement.csv", f.read())}, data={"doc_type": "bank"})
+            if resp.status_code < 400:
+                job_ids.append((i, resp.json()["job_id"]))
+            return resp
+
+        ingest_start = time.perf_counter()
+        results["POST /upload"] = await measure(upload, len(users), args.concurrency)
+        pending = dict(job_ids)
+        rows_ingested = rows_failed = 0
+        while pending:
+            await asyncio.sleep(0.1)
+            for user_index, job_id in list(pending.items()):
+                job = (await client.get(f"/upload/{job_id}", headers=auth(user_index))).json()
+                if job["status"] in ("completed", "failed"):
+                    rows_ingested += job["rows_processed"] - job["rows_failed"]
+                    rows_failed += job["rows_failed"]
+                    del pending[user_index]
+        ingest_seconds = time.perf_counter() - ingest_start
+        results["ingest (end to end)"] = {
+            "files": len(job_ids),
+            "rows_indexed": rows_ingested,
+            "rows_failed": rows_failed,
+            "elapsed_seconds": round(ingest_seconds, 3),
+            "rows_per_second": round(rows_ingested / ingest_seconds, 1) if ingest_seconds > 0 else None,
+        }
+
+        results["GET /stats"] = await measure(lambda i: client.get("/stats", headers=auth(i)), args.requests, args.concurrency)
+        results["GET /analytics/expenses"] = await measure(
+            lambda i: client.get("/analytics/expenses", headers=auth(i)), args.requests, args.concurrency
+        )
+        results["GET /transactions"] = await measure(
+            lambda i: client.get("/transactions", headers=auth(i)), max(len(users), args.requests // 10), args.concurrency
+        )
+        results["POST /chat"] = await measure(
+            lambda i: client.post("/chat", headers=auth(i), json={"message": f"how much did I spend on food {i % args.distinct_prompts}"}),
+            args.chat_requests, args.concurrency
+        )
+    finally:
+        await client.aclose()
+        if server_task is not None:
+            server.should_exit = True
+            await server_task
+        else:
+            await main.on_shutdown()
+        await agent_runner.cleanup()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": vars(args),
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--rows-per-user", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--chat-requests", type=int, default=100)
+    parser.add_argument("--distinct-prompts", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--agent-delay", type=float, default=0.05, help="stub agent latency in seconds")
+    parser.add_argument("--storage", choices=["memory", "sqlite", "elasticsearch"], default="memory")
+    parser.add_argument("--transport", choices=["asgi", "uvicorn"], default="asgi")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cache", action="store_true", help="keep the stats/chat/token caches enabled")
+    parser.add_argument("--rate-limits", action="store_true", help="keep the per-user rate limits and concurrency caps enabled")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Wrote {args.output}")
+    else:
+        print(output)
@@ -0,0 +1,166 @@
+"""
+Cold-start time of the API: `import main` and time to the first 200 from /users/me.
+
+Each run uses a fresh interpreter. The import is timed in a bare subprocess.
+Time-to-first-200 counts from launching `uvicorn main:app` until an
+authenticated GET /users/me succeeds, so it covers interpreter start, imports,
+the startup hook and the first request. The app runs against a temporary app
+database and the in-memory storage backend, so no cluster is needed.
+
+Absolute times vary too much between machines (and between runs on a busy one)
+to gate on, so --baseline REV also checks out REV in a temporary git worktree
+and times it in the same run, alternating with the working tree. Exits non-zero
+when either median is more than --tolerance slower than the baseline's, or over
+an absolute --max-*-seconds limit if one is given, so this can gate CI.
+
+Usage: python benchmarks/startup_benchmark.py [--runs 5] [--baseline origin/main] [--tolerance 0.25]
+                                               [--max-import-seconds S] [--max-ready-seconds S]
+"""
+import argparse
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpx
+
+IMPORT_SNIPPET = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def seed_user(database_url):
+    from sqlmodel import SQLModel, Session
+
+    from auth_utils import create_access_token, get_password_hash
+    from database import create_db_engine
+    from models import User
+
+    engine = create_db_engine(database_url)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(User(username="startup", email="startup@example.com", hashed_password=get_password_hash("secret")))
+        session.commit()
+    engine.dispose()
+    return create_access_token({"sub": "startup"}, expires_delta=timedelta(hours=1))
+
+
+def add_worktree(rev, workdir):
+    path = os.path.join(workdir, "baseline")
+    subprocess.run(["git", "worktree", "add", "--detach", "--quiet", path, rev], cwd=ROOT, check=True)
+    return path
+
+
+def remove_worktree(path):
+    subprocess.run(["git", "worktree", "remove", "--force", path], cwd=ROOT, check=False)
+
+
+def time_import(tree, env):
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=tree, env=env, check=True,
+                         capture_output=True, text=True).stdout
+    return float(out.strip().splitlines()[-1])
+
+
+def time_to_first_200(tree, env, token, timeout):
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=tree, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=1.0) as client:
+            while time.perf_counter() - start < timeout:
+                try:
+                    if client.get("/users/me", headers={"Authorization": f"Bearer {token}"}).status_code == 200:
+                        return time.perf_counter() - start
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+        raise RuntimeError(f"No 200 from /users/me within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def summarize(values):
+    return f"median {statistics.median(values) * 1000:7.0f}ms  min {min(values) * 1000:7.0f}ms  max {max(values) * 1000:7.0f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--baseline", metavar="REV", help="git revision to time alongside the working tree")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline median")
+    parser.add_argument("--max-import-seconds", type=float)
+    parser.add_argument("--max-ready-seconds", type=float)
+    parser.add_argument("--timeout", type=float, default=30.0, help="give up on a server that is not ready by then")
+    args = parser.parse_args()
+
+    from auth_utils import SECRET_KEY
+
+    workdir = tempfile.mkdtemp(prefix="fincontext-startup-")
+    trees = {"current": ROOT}
+    try:
+        if args.baseline:
+            trees["baseline"] = add_worktree(args.baseline, workdir)
+        envs, tokens = {}, {}
+        for name in trees:
+            database_url = f"sqlite:///{os.path.join(workdir, f'{name}.db')}"
+            envs[name] = {
+                **os.environ,
+                "DATABASE_URL": database_url,
+                "STORAGE_BACKEND": "memory",
+                "UPLOAD_DIR": os.path.join(workdir, name, "uploads"),
+                "ANALYTICS_DIR": os.path.join(workdir, name, "analytics"),
+                # The worktree has no .env, so both trees must sign and check tokens with the same key
+                "SECRET_KEY": SECRET_KEY,
+            }
+            # A single process; multiprocess metrics would write sample files into the repo
+            envs[name].pop("PROMETHEUS_MULTIPROC_DIR", None)
+            tokens[name] = seed_user(database_url)
+
+        results = {name: {"import main": [], "first 200 /users/me": []} for name in trees}
+        for _ in range(args.runs):
+            # Alternating keeps load changes on the machine from landing on one tree only
+            for name, tree in trees.items():
+                results[name]["import main"].append(time_import(tree, envs[name]))
+                results[name]["first 200 /users/me"].append(time_to_first_200(tree, envs[name], tokens[name], args.timeout))
+    finally:
+        if "baseline" in trees:
+            remove_worktree(trees["baseline"])
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    failed = False
+    for label, limit in (("import main", args.max_import_seconds), ("first 200 /users/me", args.max_ready_seconds)):
+        values = results["current"][label]
+        median = statistics.median(values)
+        verdicts, ok = [], True
+        if "baseline" in results:
+            baseline = results["baseline"][label]
+            ratio = median / statistics.median(baseline)
+            print(f"{label:>20}: baseline {summarize(baseline)}")
+            verdicts.append(f"{ratio:.2f}x baseline, allowed {1 + args.tolerance:.2f}x")
+            ok &= ratio <= 1 + args.tolerance
+        if limit is not None:
+            verdicts.append(f"limit {limit * 1000:.0f}ms")
+            ok &= median <= limit
+        failed |= not ok
+        print(f"{label:>20}: current  {summarize(values)}  ({', '.join(verdicts) or 'no limit'}) {'ok' if ok else 'REGRESSION'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
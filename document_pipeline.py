@@ -0,0 +1,162 @@
+"""
+Document pipeline for policies and other unstructured uploads:
+text extraction -> overlapping chunks -> batch embeddings -> chunk docs with dense vectors.
+"""
+import hashlib
+import math
+import os
+import re
+from typing import List
+
+DOCUMENTS_INDEX = "fincontext-documents"
+
+EMBEDDER = os.getenv("EMBEDDER", "hashing")
+EMBEDDING_DIMS = int(os.getenv("EMBEDDING_DIMS", "384"))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+CHUNK_SIZE = int(os.getenv("DOCUMENT_CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("DOCUMENT_CHUNK_OVERLAP", "200"))
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def extract_text(file_path: str) -> str:
+    if file_path.lower().endswith('.pdf'):
+        from pypdf import PdfReader
+        reader = PdfReader(file_path)
+        return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        return f.read()
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    if overlap >= chunk_size:
+        raise ValueError("chunk overlap must be smaller than chunk size")
+    text = text.strip()
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            # Prefer to cut on whitespace so words are not split across chunks
+            cut = text.rfind(" ", start + overlap + 1, end)
+            if cut == -1:
+                cut = text.rfind("\n", start + overlap + 1, end)
+            if cut != -1:
+                end = cut
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = end - overlap
+        # Start the next chunk on a word boundary too
+        boundary = min((i for i in (text.find(" ", start, end), text.find("\n", start, end)) if i != -1), default=-1)
+        if boundary != -1:
+            start = boundary + 1
+    return chunks
+
+
+class HashingEmbedder:
+    """Deterministic local embedder: signed feature hashing of word tokens, L2-normalised."""
+
+    def __init__(self, dims: int = EMBEDDING_DIMS):
+        self.dims = dims
+
+    def _embed_one(self, text: str) -> List[float]:
+        vector = [0.0] * self.dims
+        for token in _TOKEN_RE.findall(text.lower()):
+            digest = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little")
+            vector[digest % self.dims] += 1.0 if (digest >> 63) & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector))
+        if norm == 0:
+            # ES rejects zero vectors for cosine similarity
+            vector[0] = 1.0
+            return vector
+        return [v / norm for v in vector]
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed_one(text) for text in texts]
+
+
+class OpenAIEmbedder:
+    def __init__(self, model: str = EMBEDDING_MODEL, dims: int = EMBEDDING_DIMS):
+        from openai import OpenAI
+        self.client = OpenAI()
+        self.model = model
+        self.dims = dims
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        resp = self.client.embeddings.create(model=self.model, input=texts, dimensions=self.dims)
+        return [item.embedding for item in resp.data]
+
+
+_embedder = None
+
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        if EMBEDDER == "openai":
+            _embedder = OpenAIEmbedder()
+        elif EMBEDDER == "hashing":
+            _embedder = HashingEmbedder()
+        else:
+            raise ValueError(f"Unknown EMBEDDER '{EMBEDDER}'")
+    return _embedder
+
+
+def document_index_mappings(dims: int = EMBEDDING_DIMS):
+    return {
+        "properties": {
+            "embedding": {"type": "dense_vector", "dims": dims, "index": True, "similarity": "cosine"},
+            "chunk": {"type": "integer"}
+        }
+    }
+
+
+_ensured_indices = set()
+
+
+def ensure_document_index(storage, index_name: str = DOCUMENTS_INDEX, dims: int = EMBEDDING_DIMS):
+    if (storage.name, index_name) in _ensured_indices:
+        return
+    storage.ensure_mappings(index_name, document_index_mappings(dims))
+    _ensured_indices.add((storage.name, index_name))
+
+
+def chunk_doc_id(user_id, filename: str, chunk: int) -> str:
+    """Same id for the same chunk of a user's file, so re-ingesting it overwrites instead of duplicating."""
+    return hashlib.sha1(f"{user_id or ''}\x1f{filename}\x1f{chunk}".encode()).hexdigest()
+
+
+def iter_chunk_docs(text: str, filename: str, metadata: dict, user_id=None, embedder=None, batch_size: int = EMBED_BATCH_SIZE,
+                    should_stop=None):
+    """Yields one document per chunk, embedding batch_size chunks at a time; stops before a batch once should_stop() is true."""
+    embedder = embedder or get_embedder()
+    chunks = chunk_text(text)
+    for start in range(0, len(chunks), batch_size):
+        if should_stop is not None and should_stop():
+            return
+        batch = chunks[start:start + batch_size]
+        for offset, (chunk, vector) in enumerate(zip(batch, embedder.embed(batch))):
+            doc = {
+                "text": chunk,
+                "filename": filename,
+                "chunk": start + offset,
+                "embedding": vector,
+                "metadata": metadata
+            }
+            if user_id is not None:
+                doc["user_id"] = user_id
+            yield doc
+
+
+def build_knn_query(query_vector: List[float], user_id: str, k: int, user_field: str = "user_id"):
+    return {
+        "field": "embedding",
+        "query_vector": query_vector,
+        "k": k,
+        "num_candidates": max(50, k * 10),
+        "filter": {"term": {user_field: user_id}}
+    }
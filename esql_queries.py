@@ -35,6 +35,56 @@ FROM fincontext-transactions
 | STATS total = SUM(Amount), count = COUNT(*)
 """
 
+# Per-user variants served by the /analytics API; `?` is bound to the user id
+USER_EXPENSES_BY_CATEGORY = """
+FROM fincontext-transactions
+| WHERE user_id == ? AND Type == "Debit"
+| STATS total_amount = SUM(Amount) BY Category
+| SORT total_amount DESC, Category ASC
+"""
+
+USER_LARGE_TRANSACTIONS = """
+FROM fincontext-transactions
+| WHERE user_id == ? AND Amount > {threshold}
+| SORT Date DESC, Amount DESC, Description ASC
+| KEEP Date, Description, Category, Amount, Type
+| LIMIT {limit}
+"""
+
+USER_MONTHLY_TREND = """
+FROM fincontext-transactions
+| WHERE user_id == ?
+| EVAL month = DATE_TRUNC(1 month, Date)
+| STATS monthly_spend = SUM(Amount) BY month, Type
+| SORT month ASC, Type ASC
+"""
+
+# ES|QL LIKE uses * and ? as wildcards
+USER_MERCHANT_SEARCH = """
+FROM fincontext-transactions
+| WHERE user_id == ? AND Description LIKE "*{merchant}*"
+| STATS total = SUM(Amount), count = COUNT(*)
+"""
+
+def escape_like(value):
+    # Escape LIKE wildcards first, then quote the pattern for an ES|QL string literal
+    pattern = "".join("\\" + c if c in "*?\\" else c for c in value)
+    return pattern.replace("\\", "\\\\").replace('"', '\\"')
+
+def build_user_query(query_type, user_id, threshold=1000, limit=5, merchant="Zomato"):
+    """Returns (query, params) for an ES|QL request scoped to one user."""
+    if query_type == "expenses":
+        query = USER_EXPENSES_BY_CATEGORY
+    elif query_type == "large":
+        query = USER_LARGE_TRANSACTIONS.format(threshold=float(threshold), limit=int(limit))
+    elif query_type == "trend":
+        query = USER_MONTHLY_TREND
+    elif query_type == "merchant":
+        query = USER_MERCHANT_SEARCH.format(merchant=escape_like(merchant))
+    else:
+        raise ValueError(f"Unknown query type '{query_type}'")
+    return query, [user_id]
+
 def get_esql_example(query_type):
     if query_type == "expenses":
         return QUERY_EXPENSES_BY_CATEGORY
@@ -0,0 +1,162 @@
+"""
+Seeded, vectorized transaction generator for load-test datasets.
+
+Uses the categories, merchants and per-user multipliers from
+generate_user_data.py; users cycle through the alice/bob/charlie spending
+profiles. Rows are built with NumPy one batch of users at a time and appended
+to the output, so memory stays bounded by --batch-users regardless of the
+total size. The same seed and spec always produce the same files.
+
+Usage:
+    python generate_load_data.py --users 20000 --rows-per-user 100 --seed 42 \\
+        --format parquet --output load_data.parquet
+    python generate_load_data.py --users 100 --rows-per-user 500 --layout per-user --output data/users
+"""
+import argparse
+import os
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from generate_user_data import CATEGORIES, DESCRIPTIONS, user_multipliers
+
+PROFILES = ["alice", "bob", "charlie"]
+COLUMNS = ["Date", "Description", "Category", "Amount", "Type"]
+DEFAULT_SALARY = 50000
+
+# Lookup tables indexed by [profile, category]
+_MERCHANTS = np.array([desc for category in CATEGORIES for desc in DESCRIPTIONS[category]], dtype=object)
+_MERCHANT_COUNTS = np.array([len(DESCRIPTIONS[category]) for category in CATEGORIES])
+_MERCHANT_OFFSETS = np.concatenate([[0], np.cumsum(_MERCHANT_COUNTS)[:-1]])
+_CATEGORY_NAMES = np.array(CATEGORIES, dtype=object)
+_SALARY = CATEGORIES.index("Salary")
+_MULTIPLIERS = np.array([[user_multipliers(p).get(c, 1.0) for c in CATEGORIES] for p in PROFILES])
+_SALARIES = np.array([user_multipliers(p).get("Salary", DEFAULT_SALARY) for p in PROFILES], dtype=float)
+
+
+def user_name(index: int) -> str:
+    return f"user{index:06d}"
+
+
+def generate_batch(seed: int, batch_index: int, first_user: int, num_users: int, rows_per_user: int,
+                   end_date: date, days: int) -> pd.DataFrame:
+    # Each batch gets its own stream so output does not depend on batch scheduling
+    rng = np.random.default_rng([seed, batch_index])
+    n = num_users * rows_per_user
+    user_index = np.repeat(np.arange(first_user, first_user + num_users), rows_per_user)
+    profile = user_index % len(PROFILES)
+
+    category = rng.integers(0, len(CATEGORIES), n)
+    merchant = _MERCHANT_OFFSETS[category] + (rng.random(n) * _MERCHANT_COUNTS[category]).astype(np.int64)
+    dates = np.datetime64(end_date, "D") - rng.integers(0, days + 1, n)
+    is_salary = category == _SALARY
+    amount = np.where(
+        is_salary,
+        _SALARIES[profile],
+        rng.integers(100, 2001, n) * _MULTIPLIERS[profile, category]
+    ).round(2)
+
+    return pd.DataFrame({
+        "user_id": np.array([user_name(i) for i in range(first_user, first_user + num_users)], dtype=object).repeat(rows_per_user),
+        "Date": np.datetime_as_string(dates, unit="D"),
+        "Description": _MERCHANTS[merchant],
+        "Category": _CATEGORY_NAMES[category],
+        "Amount": amount,
+        "Type": np.where(is_salary, "Credit", "Debit"),
+    })
+
+
+class ParquetSink:
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow: pip install pyarrow")
+        self._pa, self._pq = pa, pq
+        self.path = path
+        self._writer = None
+
+    def write(self, df: pd.DataFrame):
+        table = self._pa.Table.from_pandas(df, preserve_index=False)
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self.path, table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+class CsvSink:
+    def __init__(self, path):
+        self.path = path
+        self._header = True
+
+    def write(self, df: pd.DataFrame):
+        df.to_csv(self.path, mode="w" if self._header else "a", header=self._header, index=False)
+        self._header = False
+
+    def close(self):
+        pass
+
+
+def write_per_user(df: pd.DataFrame, output_dir: str, fmt: str):
+    # One file per user, same layout as generate_user_data.py (<dir>/<user>/transactions.csv)
+    for user, rows in df.groupby("user_id", sort=False):
+        user_dir = os.path.join(output_dir, user)
+        os.makedirs(user_dir, exist_ok=True)
+        path = os.path.join(user_dir, f"transactions.{fmt}")
+        if fmt == "csv":
+            rows[COLUMNS].to_csv(path, index=False)
+        else:
+            rows[COLUMNS].to_parquet(path, index=False)
+
+
+def generate(output, users, rows_per_user, seed=0, fmt="csv", layout="single", batch_users=1000,
+             end_date=date(2025, 1, 1), days=60):
+    if fmt == "parquet" and layout == "per-user":
+        ParquetSink(os.devnull)  # fail early if pyarrow is missing
+    sink = None
+    if layout == "single":
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        sink = CsvSink(output) if fmt == "csv" else ParquetSink(output)
+
+    total = 0
+    try:
+        for batch_index, first_user in enumerate(range(0, users, batch_users)):
+            num_users = min(batch_users, users - first_user)
+            df = generate_batch(seed, batch_index, first_user, num_users, rows_per_user, end_date, days)
+            if sink is not None:
+                sink.write(df)
+            else:
+                write_per_user(df, output, fmt)
+            total += len(df)
+    finally:
+        if sink is not None:
+            sink.close()
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rows-per-user", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--layout", choices=["single", "per-user"], default="single",
+                        help="one file with a user_id column, or <output>/<user>/transactions.<format>")
+    parser.add_argument("--batch-users", type=int, default=1000, help="users generated and written per chunk")
+    parser.add_argument("--end-date", type=date.fromisoformat, default=date(2025, 1, 1))
+    parser.add_argument("--days", type=int, default=60, help="transactions fall within this many days before --end-date")
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rows = generate(args.output, args.users, args.rows_per_user, seed=args.seed, fmt=args.format,
+                    layout=args.layout, batch_users=args.batch_users, end_date=args.end_date, days=args.days)
+    elapsed = time.perf_counter() - start
+    print(f"Generated {rows} transactions for {args.users} users at {args.output} "
+          f"in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s)")
@@ -2,18 +2,28 @@ import pandas as pd
 import random
 from datetime import datetime, timedelta
 
+CATEGORIES = ["Food", "Transport", "Rent", "Utilities", "Shopping", "Entertainment", "Investment", "Salary"]
+DESCRIPTIONS = {
+    "Food": ["Zomato", "Swiggy", "Starbucks", "Local Grocery"],
+    "Transport": ["Uber", "Ola", "Petrol Pump"],
+    "Rent": ["Home Rent"],
+    "Utilities": ["Electricity", "Airtel Bill", "Netflix"],
+    "Shopping": ["Amazon", "Myntra"],
+    "Entertainment": ["Movie", "Gaming"],
+    "Investment": ["Mutual Fund", "Stock Purchase"],
+    "Salary": ["Monthly Payout"]
+}
+
+def user_multipliers(user_name):
+    if user_name == "alice":
+        return {"Salary": 60000, "Food": 5.0, "Shopping": 3.0}
+    elif user_name == "bob":
+        return {"Salary": 80000, "Food": 1.0, "Investment": 10.0}
+    return {"Salary": 150000, "Rent": 2.0}
+
 def generate_transactions(user_name, filename):
-    categories = ["Food", "Transport", "Rent", "Utilities", "Shopping", "Entertainment", "Investment", "Salary"]
-    descriptions = {
-        "Food": ["Zomato", "Swiggy", "Starbucks", "Local Grocery"],
-        "Transport": ["Uber", "Ola", "Petrol Pump"],
-        "Rent": ["Home Rent"],
-        "Utilities": ["Electricity", "Airtel Bill", "Netflix"],
-        "Shopping": ["Amazon", "Myntra"],
-        "Entertainment": ["Movie", "Gaming"],
-        "Investment": ["Mutual Fund", "Stock Purchase"],
-        "Salary": ["Monthly Payout"]
-    }
+    categories = CATEGORIES
+    descriptions = DESCRIPTIONS
 
     data = []
     start_date = datetime.now() - timedelta(days=60)
@@ -23,12 +33,7 @@ def generate_transactions(user_name, filename):
                                          
     
     num_rows = 30
-    if user_name == "alice":
-        multipliers = {"Salary": 60000, "Food": 5.0, "Shopping": 3.0}
-    elif user_name == "bob":
-        multipliers = {"Salary": 80000, "Food": 1.0, "Investment": 10.0}
-    else:
-        multipliers = {"Salary": 150000, "Rent": 2.0}
+    multipliers = user_multipliers(user_name)
 
     for _ in range(num_rows):
         category = random.choice(categories)
@@ -0,0 +1,141 @@
+"""
+Index templates for the fincontext indices.
+
+Strings are mapped as keyword only (no text + .keyword multi-field from dynamic
+mapping), Date as date and Amount as scaled_float. Writes and per-user reads are
+routed by user_id, so a user's queries hit a single shard.
+
+Installed at API startup for the Elasticsearch backend. Templates do not change
+existing indices, so the API also checks their mappings: one still on dynamic
+mapping is logged as an error, and queried through the .keyword subfields of
+its text fields until it is migrated. Can also be run by hand:
+
+    python index_templates.py install
+    python index_templates.py migrate fincontext-transactions   # re-create an index created before the templates
+"""
+import argparse
+import logging
+import os
+
+from document_pipeline import DOCUMENTS_INDEX, EMBEDDING_DIMS, document_index_mappings
+
+logger = logging.getLogger(__name__)
+
+TRANSACTIONS_INDEX = "fincontext-transactions"
+INDEX_SHARDS = int(os.getenv("INDEX_SHARDS", "1"))
+INDEX_REPLICAS = int(os.getenv("INDEX_REPLICAS", "1"))
+TEMPLATE_VERSION = 1
+
+# Any string field not listed explicitly (extra CSV columns) is keyword only
+STRINGS_AS_KEYWORDS = {
+    "strings_as_keywords": {"match_mapping_type": "string", "mapping": {"type": "keyword", "ignore_above": 1024}}
+}
+
+
+def index_settings():
+    return {"number_of_shards": INDEX_SHARDS, "number_of_replicas": INDEX_REPLICAS}
+
+
+def transactions_template():
+    return {
+        "settings": index_settings(),
+        "mappings": {
+            "dynamic_templates": [STRINGS_AS_KEYWORDS],
+            "properties": {
+                "user_id": {"type": "keyword"},
+                "Date": {"type": "date"},
+                "Description": {"type": "keyword", "ignore_above": 1024},
+                "Category": {"type": "keyword"},
+                "Type": {"type": "keyword"},
+                "Amount": {"type": "scaled_float", "scaling_factor": 100},
+            }
+        }
+    }
+
+
+def documents_template(dims: int = EMBEDDING_DIMS):
+    properties = {
+        "user_id": {"type": "keyword"},
+        "filename": {"type": "keyword"},
+        "text": {"type": "text"},
+        "metadata": {"properties": {"type": {"type": "keyword"}, "timestamp": {"type": "date"}}},
+    }
+    properties.update(document_index_mappings(dims)["properties"])
+    return {
+        "settings": index_settings(),
+        "mappings": {"dynamic_templates": [STRINGS_AS_KEYWORDS], "properties": properties}
+    }
+
+
+TEMPLATES = {
+    TRANSACTIONS_INDEX: transactions_template,
+    DOCUMENTS_INDEX: documents_template,
+}
+
+
+def install_index_templates(client):
+    for index_name, build in TEMPLATES.items():
+        client.indices.put_index_template(
+            name=index_name,
+            index_patterns=[index_name, f"{index_name}-*"],
+            template=build(),
+            priority=100,
+            version=TEMPLATE_VERSION
+        )
+    logger.info("Installed index templates for %s", ", ".join(TEMPLATES))
+
+
+def check_legacy_indices(storage):
+    """Logs an error for each existing index still on dynamic mapping; storage queries its .keyword subfields meanwhile."""
+    for index_name in TEMPLATES:
+        text_fields = storage.check_mappings(index_name)
+        if text_fields:
+            logger.error(
+                "%s was created before the index templates and maps %s as text. Queries use their .keyword "
+                "subfields until `python index_templates.py migrate %s` is run and the API restarted",
+                index_name, ", ".join(text_fields), index_name
+            )
+
+
+def migrate_index(client, index_name: str):
+    """Re-creates an index from its template, keeping its documents and routing them by user_id.
+
+    Copies to <index>-migrate (which also matches the template), then recreates the index and copies back.
+    """
+    temp_index = f"{index_name}-migrate"
+    route_by_user = {"source": "if (ctx._source.user_id != null) { ctx._routing = ctx._source.user_id }", "lang": "painless"}
+
+    def copy(source, dest):
+        resp = client.options(request_timeout=3600).reindex(
+            source={"index": source}, dest={"index": dest}, script=route_by_user, refresh=True, wait_for_completion=True
+        )
+        if resp.get("failures"):
+            raise RuntimeError(f"Reindex {source} -> {dest} failed: {resp['failures'][:3]}")
+
+    client.indices.delete(index=temp_index, ignore_unavailable=True)
+    copy(index_name, temp_index)
+    client.indices.delete(index=index_name)
+    copy(temp_index, index_name)
+    client.indices.delete(index=temp_index)
+    logger.info("Migrated %s to the template mapping", index_name)
+
+
+if __name__ == "__main__":
+    from storage import create_sync_es_client
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("install", help="install or update the index templates")
+    migrate = subcommands.add_parser("migrate", help="re-create existing indices with the template mappings")
+    migrate.add_argument("indices", nargs="+", choices=list(TEMPLATES))
+    args = parser.parse_args()
+
+    client = create_sync_es_client()
+    try:
+        install_index_templates(client)
+        if args.command == "migrate":
+            for index_name in args.indices:
+                migrate_index(client, index_name)
+    finally:
+        client.close()
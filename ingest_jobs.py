@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+from sqlalchemy import func, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select
+
+from models import IngestJob, UserDataVersion
+from document_pipeline import DOCUMENTS_INDEX
+
+TRANSACTIONS_INDEX = "fincontext-transactions"
+
+logger = logging.getLogger(__name__)
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+def job_summary(job: IngestJob):
+    end = job.finished_at or utcnow()
+    elapsed = (end - job.started_at).total_seconds() if job.started_at else 0.0
+    return {
+        "job_id": job.id,
+        "filename": job.filename,
+        "status": job.status,
+        "rows_processed": job.rows_processed,
+        "rows_failed": job.rows_failed,
+        "rows_new": job.rows_new,
+        "rows_updated": job.rows_updated,
+        "rows_skipped": job.rows_skipped,
+        "chunks_processed": job.chunks_processed,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(job.rows_processed / elapsed, 1) if elapsed > 0 else 0.0,
+        "errors": json.loads(job.errors),
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def count_pending_jobs(session: Session, user_id=None) -> int:
+    """Queued and running jobs across every worker sharing the app database; user_id narrows to one user."""
+    query = select(func.count()).select_from(IngestJob).where(IngestJob.status.in_(("queued", "running")))
+    if user_id is not None:
+        query = query.where(IngestJob.user_id == user_id)
+    return session.exec(query).one()
+
+
+def data_version(session: Session, user_id: str) -> int:
+    row = session.get(UserDataVersion, user_id)
+    return row.version if row else 0
+
+
+def bump_data_version(engine, user_id: str):
+    insert = (postgresql if engine.dialect.name == "postgresql" else sqlite).insert(UserDataVersion)
+    statement = insert.values(user_id=user_id, version=1).on_conflict_do_update(
+        index_elements=["user_id"], set_={"version": UserDataVersion.version + 1}
+    )
+    with Session(engine) as session:
+        session.exec(statement)
+        session.commit()
+
+
+def requeue_running_jobs(engine) -> int:
+    """Puts jobs left "running" by a stopped process back in the queue.
+
+    Only safe while no process is running jobs against this database, since a live
+    job would be claimed and run again: serve.py calls it once before starting workers.
+    """
+    with Session(engine) as session:
+        result = session.exec(update(IngestJob).where(IngestJob.status == "running").values(status="queued"))
+        session.commit()
+    if result.rowcount:
+        logger.info("Re-queued %d ingest jobs left running by a stopped process", result.rowcount)
+    return result.rowcount
+
+
+class IngestJobQueue:
+    """Runs /upload ingestion jobs on a bounded thread pool, tracking state in SQLite."""
+
+    def __init__(self, engine, max_workers=2, on_complete=None, store=None, rollups=None):
+        self.engine = engine
+        self.max_workers = max_workers
+        self.on_complete = on_complete
+        self.store = store
+        self.rollups = rollups
+        self.storage = None
+        self.executor = None
+        self._futures = set()
+        self._stopping = threading.Event()
+
+    def start(self, storage, recover_running=True):
+        """recover_running re-queues jobs a stopped process left running; only for a single process."""
+        self.storage = storage
+        self._stopping.clear()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ingest")
+        if recover_running:
+            requeue_running_jobs(self.engine)
+        self.resume()
+
+    def shutdown(self, drain_timeout=None):
+        """Queued jobs stay "queued" in the DB and resume on next start.
+
+        Running jobs get drain_timeout seconds (None waits for them) to finish; after that
+        they stop before their next chunk, once everything already sent is indexed, and are
+        put back in the queue.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            _, running = wait(list(self._futures), timeout=drain_timeout)
+            if running:
+                logger.warning("Interrupting %d ingest jobs still running after %ss", len(running), drain_timeout)
+                self._stopping.set()
+                wait(running)
+            self.executor = None
+        self.storage = None
+
+    def submit(self, job_id: str):
+        future = self.executor.submit(self._run, job_id)
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+
+    def resume(self):
+        with Session(self.engine) as session:
+            job_ids = session.exec(
+                select(IngestJob.id).where(IngestJob.status == "queued").order_by(IngestJob.created_at)
+            ).all()
+        for job_id in job_ids:
+            self.submit(job_id)
+
+    def _claim(self, job_id: str) -> bool:
+        # Every API worker resumes the queued jobs at startup; only the one whose update lands runs each job
+        with Session(self.engine) as session:
+            result = session.exec(
+                update(IngestJob)
+                .where(IngestJob.id == job_id, IngestJob.status == "queued")
+                .values(status="running", started_at=utcnow())
+            )
+            session.commit()
+            return result.rowcount == 1
+
+    def _rebuild_user_copies(self, user_id: str):
+        # Updated rows replace values the local copy and rollups already counted; only new rows are appended
+        self.storage.refresh(TRANSACTIONS_INDEX)
+        if self.store is not None:
+            self.store.drop_user(user_id)
+            self.store.ensure_user(self.storage, user_id, TRANSACTIONS_INDEX)
+        if self.rollups is not None:
+            self.rollups.rebuild_user(self.storage, user_id, TRANSACTIONS_INDEX)
+
+    def _run(self, job_id: str):
+        if not self._claim(job_id):
+            return
+        with Session(self.engine) as session:
+            job = session.get(IngestJob, job_id)
+            job.rows_processed = job.rows_failed = job.chunks_processed = 0
+            job.rows_new = job.rows_updated = job.rows_skipped = 0
+            session.add(job)
+            session.commit()
+
+            def progress(report):
+                job.rows_processed = report["indexed"] + report.get("skipped", 0) + report["failed"]
+                job.rows_failed = report["failed"]
+                job.rows_new = report.get("new", report["indexed"])
+                job.rows_updated = report.get("updated", 0)
+                job.rows_skipped = report.get("skipped", 0)
+                job.chunks_processed = len(report["chunks"])
+                job.errors = json.dumps(report["errors"], default=str)
+                session.add(job)
+                session.commit()
+
+            try:
+                # Loads pandas/NumPy with the first job rather than at app import
+                from ingest_to_elastic import ingest_structured_data, ingest_unstructured_data
+
+                if job.filename.endswith('.csv'):
+                    if self.store is not None:
+                        self.store.ensure_user(self.storage, job.user_id, TRANSACTIONS_INDEX)
+                    if self.rollups is not None:
+                        self.rollups.ensure_user(self.storage, job.user_id, TRANSACTIONS_INDEX)
+
+                    def sink(df):
+                        if self.store is not None:
+                            self.store.append(job.user_id, df)
+                        if self.rollups is not None:
+                            self.rollups.add(job.user_id, df)
+
+                    report = ingest_structured_data(
+                        job.file_path, TRANSACTIONS_INDEX, user_id=job.user_id,
+                        storage=self.storage, progress=progress,
+                        sink=sink if self.store is not None or self.rollups is not None else None,
+                        should_stop=self._stopping.is_set
+                    )
+                    if report["updated"]:
+                        self._rebuild_user_copies(job.user_id)
+                else:
+                    report = ingest_unstructured_data(
+                        job.file_path, DOCUMENTS_INDEX, user_id=job.user_id,
+                        doc_type=job.doc_type, filename=job.filename, storage=self.storage,
+                        progress=progress, should_stop=self._stopping.is_set
+                    )
+                job.status = "queued" if report.get("interrupted") else "completed"
+            except Exception as e:
+                logger.exception("Ingest job %s failed", job_id)
+                report = None
+                job.status = "failed"
+                job.error = str(e)
+            if job.status == "queued":
+                # The upload stays on disk; the next start re-runs it, and rows (or chunks) already
+                # indexed come back as no-ops (or overwrite themselves) on their deterministic ids
+                logger.info("Ingest job %s interrupted by shutdown, re-queued", job_id)
+            else:
+                job.finished_at = utcnow()
+            session.add(job)
+            session.commit()
+            session.refresh(job)
+
+        if job.status != "queued" and os.path.exists(job.file_path):
+            os.remove(job.file_path)
+        # Also after an interrupted run: whatever it indexed is already visible
+        if report is not None and report["indexed"]:
+            # Tells the other API workers to drop their cached answers and stats for the user
+            bump_data_version(self.engine, job.user_id)
+        if self.on_complete and report is not None:
+            self.on_complete(job, report)
@@ -1,54 +1,475 @@
+import argparse
+import hashlib
+import json
+import logging
 import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime
+import numpy as np
 import pandas as pd
-from elasticsearch import Elasticsearch, helpers
 from dotenv import load_dotenv
 
+from metrics import observe_phase
+import transaction_parser
+from document_pipeline import DOCUMENTS_INDEX, chunk_doc_id, extract_text, iter_chunk_docs, ensure_document_index
+from storage import create_storage, ELASTIC_CLOUD_ID, ELASTIC_API_KEY
+
 load_dotenv()
 
                            
-ELASTIC_CLOUD_ID = os.getenv("ELASTIC_CLOUD_ID")
-ELASTIC_API_KEY = os.getenv("ELASTIC_API_KEY")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", "5000"))
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))
+MAX_REPORTED_ERRORS = 100
+TRANSACTIONS_INDEX = "fincontext-transactions"
+DOCUMENT_EXTENSIONS = (".md", ".txt", ".pdf")
 
-if not ELASTIC_CLOUD_ID or not ELASTIC_API_KEY:
-    print("Warning: ELASTIC_CLOUD_ID or ELASTIC_API_KEY not found in environment variables.")
+logger = logging.getLogger(__name__)
 
-es = Elasticsearch(
-    cloud_id=ELASTIC_CLOUD_ID,
-    api_key=ELASTIC_API_KEY
-)
+_storage = None
 
-def ingest_structured_data(file_path, index_name):
-    df = pd.read_csv(file_path)
-                                          
-    df['Date'] = pd.to_datetime(df['Date'])
-    
-    actions = [
-        {
-            "_index": index_name,
-            "_source": record
-        }
-        for record in df.to_dict('records')
+def get_storage():
+    global _storage
+    if _storage is None:
+        _storage = create_storage()
+    return _storage
+
+def read_transaction_chunks_with_lines(file_path, chunk_size=UPLOAD_CHUNK_SIZE, user_id=None):
+    """Yields (chunk, file line each row starts on), skipping blank lines as the fast path does."""
+    next_line = 2  # line 1 is the header
+    offset = 0
+    quoted = transaction_parser.has_quotes(file_path)
+    for chunk in pd.read_csv(file_path, chunksize=chunk_size, encoding="utf-8", **transaction_parser.READ_OPTIONS):
+        record_lines = np.arange(next_line, next_line + len(chunk))
+        next_line += len(chunk)
+        lines, _, offset = transaction_parser.file_lines(record_lines, chunk, offset, quoted)
+        blank = transaction_parser.blank_rows(chunk)
+        if blank.any():
+            chunk, lines = chunk[~blank].reset_index(drop=True), lines[~blank]
+        if user_id is not None:
+            chunk['user_id'] = user_id
+        if 'Date' in chunk.columns:
+            chunk['Date'] = pd.to_datetime(chunk['Date'])
+        yield chunk, lines
+
+def read_transaction_chunks(file_path, chunk_size=UPLOAD_CHUNK_SIZE, user_id=None):
+    for chunk, _ in read_transaction_chunks_with_lines(file_path, chunk_size, user_id):
+        yield chunk
+
+def timed_iter(iterable, timings, key):
+    """Yields from iterable, adding the time spent producing items to timings[key]."""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            timings[key] += time.perf_counter() - start
+            return
+        timings[key] += time.perf_counter() - start
+        yield item
+
+def hash_transaction_keys(user_ids, dates, descriptions, amounts, types):
+    """sha1 of each row's key fields joined by \\x1f; amounts are floats rounded to cents."""
+    return [
+        hashlib.sha1(f"{user}\x1f{date}\x1f{description}\x1f{amount}\x1f{tx_type}".encode()).hexdigest()
+        for user, date, description, amount, tx_type in zip(user_ids, dates, descriptions, amounts, types)
     ]
-    
-    helpers.bulk(es, actions)
-    print(f"Ingested {len(actions)} transactions into {index_name}")
 
-def ingest_unstructured_data(file_path, index_name):
-    with open(file_path, 'r') as f:
-        content = f.read()
+def transaction_ids(chunk):
+    """Deterministic ids from user, Date, Description, Amount and Type, so re-uploads upsert instead of duplicating."""
+    def column(name):
+        return chunk[name] if name in chunk.columns else pd.Series("", index=chunk.index)
+
+    def strings(series):
+        return series.fillna("").astype(str).tolist()
+
+    dates = column("Date")
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        dates = dates.dt.strftime("%Y-%m-%dT%H:%M:%S")
+    # float64 even when a chunk only has whole amounts, so an id does not depend on the rest of its chunk
+    amounts = pd.to_numeric(column("Amount"), errors="coerce").astype("float64").round(2)
+    return hash_transaction_keys(
+        strings(column("user_id")), strings(dates), strings(column("Description")), amounts.tolist(), strings(column("Type"))
+    )
+
+def transaction_action(index_name, doc_id, record):
+    # Unchanged documents come back as "noop" without a new version being written
+    if "Amount" in record:
+        record = {**record, "Amount": transaction_parser.json_amount(record["Amount"])}
+    return {"_op_type": "update", "_index": index_name, "_id": doc_id, "doc": record, "doc_as_upsert": True}
+
+def count_result(report, ok, item):
+    """Tallies one bulk result into report; returns "new", "updated", "skipped" or "failed"."""
+    if not ok:
+        outcome = "failed"
+    else:
+        result = next(iter(item.values()), {}).get("result")
+        outcome = {"noop": "skipped", "updated": "updated"}.get(result, "new")
+    report[outcome] += 1
+    if outcome in ("new", "updated"):
+        report["indexed"] += 1
+    return outcome
+
+def ingest_structured_data(file_path, index_name, user_id=None, storage=None, chunk_size=UPLOAD_CHUNK_SIZE, progress=None, sink=None,
+                           fast_path=True, should_stop=None):
+    """Streams a transactions CSV into index_name, upserting each row on its transaction id.
+
+    Rows repeated within a chunk are skipped before indexing, and rows already in the index
+    (including repeats of rows from earlier chunks) come back as no-ops, so re-uploading a
+    statement writes nothing. sink(df) receives the
+    rows of each chunk that were new to the index.
+
+    Files with exactly the Date, Description, Category, Amount, Type columns go through
+    transaction_parser (unless fast_path is False): typed columns, pre-encoded bulk lines,
+    and rows that do not fit the schema counted as failed with their line number. Other
+    CSVs are indexed column for column as pandas reads them.
+
+    should_stop() is checked before each chunk is sent. Once it is true no further
+    chunks are read, everything already sent is accounted for, and the report is
+    returned with "interrupted" set.
+    """
+    storage = storage or get_storage()
+    report = {"indexed": 0, "new": 0, "updated": 0, "skipped": 0, "failed": 0, "chunks": [], "errors": []}
+    # Bulk results arrive in action order: (chunk state, row in chunk) for each action sent
+    sent = deque()
+    open_chunks = deque()
+    fast_path = fast_path and transaction_parser.has_transaction_schema(file_path)
+
+    def parsed_chunks():
+        """Yields (frame, ids, line numbers, rejected rows, encode(positions) -> actions) per chunk."""
+        if fast_path:
+            for frame, dates, lines, rejects in transaction_parser.read_transaction_chunks(file_path, chunk_size, user_id):
+                ids = hash_transaction_keys(
+                    [user_id or ""] * len(frame), np.char.add(dates, "T00:00:00").tolist(), frame["Description"].tolist(),
+                    frame["Amount"].round(2).tolist(), frame["Type"].astype(str).tolist()
+                )
+
+                def encode(positions, frame=frame, dates=dates, ids=ids):
+                    return transaction_parser.encode_update_actions(
+                        index_name, [ids[pos] for pos in positions], frame.iloc[positions], dates[positions], user_id
+                    )
+                yield frame, ids, lines, rejects, encode
+            return
+
+        for chunk, lines in read_transaction_chunks_with_lines(file_path, chunk_size, user_id):
+            ids = transaction_ids(chunk)
+
+            def encode(positions, chunk=chunk, ids=ids):
+                records = chunk.iloc[positions].to_dict('records')
+                return [transaction_action(index_name, ids[pos], record) for pos, record in zip(positions, records)]
+            yield chunk, ids, lines, [], encode
+
+    def actions():
+        for frame, ids, lines, rejects, encode in parsed_chunks():
+            if should_stop is not None and should_stop():
+                report["interrupted"] = True
+                return
+            # Per chunk, so memory stays bounded by chunk_size however large the file is
+            keep, seen = [], set()
+            for pos, doc_id in enumerate(ids):
+                if doc_id not in seen:
+                    seen.add(doc_id)
+                    keep.append(pos)
+            stats = {"chunk": len(report["chunks"]) + 1, "rows": len(frame) + len(rejects), "new": 0, "updated": 0,
+                     "skipped": len(frame) - len(keep), "failed": len(rejects)}
+            report["chunks"].append(stats)
+            report["skipped"] += stats["skipped"]
+            report["failed"] += len(rejects)
+            report["errors"].extend(rejects[:max(0, MAX_REPORTED_ERRORS - len(report["errors"]))])
+            state = {"stats": stats, "frame": frame, "new_rows": np.zeros(len(frame), dtype=bool),
+                     "remaining": len(keep), "lines": lines}
+            open_chunks.append(state)
+            for pos, action in zip(keep, encode(keep)):
+                sent.append((state, pos))
+                yield action
+
+    def close_finished_chunks():
+        while open_chunks and open_chunks[0]["remaining"] == 0:
+            state = open_chunks.popleft()
+            if sink:
+                sink(state["frame"][state["new_rows"]])
+            if progress:
+                progress(report)
+
+    # Actions are produced lazily inside bulk, so parse time is measured on the generator
+    timings = {"parse": 0.0}
+    start = time.perf_counter()
+    bulk = storage.bulk_encoded if fast_path else storage.bulk
+    for ok, item in bulk(timed_iter(actions(), timings, "parse"), chunk_size=BULK_CHUNK_SIZE):
+        state, pos = sent.popleft()
+        outcome = count_result(report, ok, item)
+        state["stats"][outcome] += 1
+        if outcome == "new":
+            state["new_rows"][pos] = True
+        elif outcome == "failed" and len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"line": int(state["lines"][pos]), "error": next(iter(item.values()), {}).get("error")})
+        state["remaining"] -= 1
+        close_finished_chunks()
+    close_finished_chunks()
+
+    report["parse_seconds"] = round(timings["parse"], 3)
+    report["index_seconds"] = round(time.perf_counter() - start - timings["parse"], 3)
+    observe_phase("ingest.csv_parse", report["parse_seconds"])
+    observe_phase("ingest.bulk_index", report["index_seconds"])
+    if progress:
+        progress(report)
+    logger.info(
+        "Ingested transactions into %s: %s new, %s updated, %s skipped, %s failed",
+        index_name, report["new"], report["updated"], report["skipped"], report["failed"]
+    )
+    return report
+
+def ingest_unstructured_data(file_path, index_name, user_id=None, doc_type="insurance_policy", filename=None, storage=None, progress=None,
+                             should_stop=None):
+    """Chunks, embeds and indexes a document; each chunk has a deterministic id, so re-ingesting it overwrites.
+
+    should_stop() is checked before each embedding batch, with the same "interrupted" report as ingest_structured_data.
+    """
+    storage = storage or get_storage()
+    start = time.perf_counter()
+    content = extract_text(file_path)
+    observe_phase("ingest.document_extract", time.perf_counter() - start)
     
                                                                    
                                                            
-    doc = {
-        "text": content,
-        "filename": os.path.basename(file_path),
-        "metadata": {"type": "insurance_policy"}
-    }
-    
-    es.index(index=index_name, document=doc)
-    print(f"Ingested {file_path} into {index_name}")
+    metadata = {"type": doc_type, "timestamp": datetime.now().isoformat()}
+    report = {"indexed": 0, "failed": 0, "chunks": [], "errors": []}
+
+    def stop_requested():
+        report["interrupted"] = should_stop is not None and should_stop()
+        return report["interrupted"]
+
+    filename = filename or os.path.basename(file_path)
+    docs = iter_chunk_docs(content, filename, metadata, user_id=user_id, should_stop=stop_requested)
+    actions = (
+        {"_index": index_name, "_id": chunk_doc_id(user_id, filename, doc["chunk"]), "_source": doc} for doc in docs
+    )
+
+    ensure_document_index(storage, index_name)
+    # Chunking and embedding run lazily inside bulk; time them apart from indexing
+    timings = {"embed": 0.0}
+    start = time.perf_counter()
+    for ok, item in storage.bulk(timed_iter(actions, timings, "embed"), chunk_size=BULK_CHUNK_SIZE):
+        if ok:
+            report["indexed"] += 1
+        else:
+            report["failed"] += 1
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append({"chunk": report["indexed"] + report["failed"] - 1, "error": item.get("index", {}).get("error")})
+
+    observe_phase("ingest.document_embed", timings["embed"])
+    observe_phase("ingest.bulk_index", time.perf_counter() - start - timings["embed"])
+    if progress:
+        progress(report)
+    logger.info("Ingested %s into %s as %s chunks", file_path, index_name, report['indexed'])
+    return report
+
+def discover_files(root):
+    """Yields (relative path, user_id, kind) for each ingestible file under root, in a stable order.
+
+    Files in <root>/<user>/... belong to <user>, matching the generate_user_data.py layout.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            rel_path = os.path.relpath(os.path.join(dirpath, name), root)
+            parts = rel_path.split(os.sep)
+            user_id = parts[0] if len(parts) > 1 else None
+            ext = os.path.splitext(name)[1].lower()
+            if ext == ".csv":
+                yield rel_path, user_id, "transactions"
+            elif ext in DOCUMENT_EXTENSIONS:
+                yield rel_path, user_id, "document"
+
+def parse_file(root, rel_path, user_id, kind, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Returns ([(doc_id, position, source), ...], rows skipped as repeats within the file).
+
+    Runs in a worker process: CSV parsing and document embedding are the CPU-heavy part of a backfill.
+    """
+    file_path = os.path.join(root, rel_path)
+    if kind == "transactions":
+        docs, seen, position = [], set(), 0
+        for chunk in read_transaction_chunks(file_path, chunk_size, user_id):
+            for doc_id, record in zip(transaction_ids(chunk), chunk.to_dict('records')):
+                if doc_id not in seen:
+                    seen.add(doc_id)
+                    docs.append((doc_id, position, record))
+                position += 1
+        return docs, position - len(docs)
+    metadata = {"type": "insurance_policy", "timestamp": datetime.now().isoformat()}
+    filename = os.path.basename(file_path)
+    chunks = iter_chunk_docs(extract_text(file_path), filename, metadata, user_id=user_id)
+    return [(chunk_doc_id(user_id, filename, doc["chunk"]), doc["chunk"], doc) for doc in chunks], 0
+
+def load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+def bulk_load(root, storage=None, workers=None, thread_count=4, chunk_size=BULK_CHUNK_SIZE, checkpoint=None,
+              transactions_index=TRANSACTIONS_INDEX, documents_index=DOCUMENTS_INDEX, on_file_done=None):
+    """Ingests every file under root: a process pool parses, parallel_bulk indexes.
+
+    Files that finish are appended to the checkpoint file, and files already listed there
+    are skipped, so an interrupted backfill can be re-run with the same checkpoint.
+    """
+    storage = storage or get_storage()
+    workers = workers or os.cpu_count() or 1
+    done = load_checkpoint(checkpoint)
+    files = [f for f in discover_files(root) if f[0] not in done]
+    report = {"files": len(files), "files_skipped": len(done), "files_failed": 0,
+              "indexed": 0, "new": 0, "updated": 0, "skipped": 0, "failed": 0, "errors": []}
+    if any(kind == "document" for _, _, kind in files):
+        ensure_document_index(storage, documents_index)
+
+    # [rel_path, user_id, kind, positions, results seen, failures], oldest first; bulk results arrive in action order
+    in_flight = deque()
+    lock = threading.Lock()
+    checkpoint_file = open(checkpoint, "a") if checkpoint else None
+
+    def add_error(entry):
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append(entry)
+
+    def file_done(rel_path, user_id, kind, failed):
+        # Files with failed docs stay out of the checkpoint so a resumed run retries them
+        if checkpoint_file and not failed:
+            with lock:
+                checkpoint_file.write(rel_path + "\n")
+                checkpoint_file.flush()
+        if on_file_done:
+            on_file_done(rel_path, user_id, kind)
+
+    def actions():
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            queued = iter(files)
+            pending = deque()
+
+            def submit_next():
+                spec = next(queued, None)
+                if spec is not None:
+                    pending.append((spec, pool.submit(parse_file, root, *spec)))
+
+            # Bound parsed-but-unindexed files so memory does not grow with the tree size
+            for _ in range(workers * 2):
+                submit_next()
+            while pending:
+                (rel_path, user_id, kind), future = pending.popleft()
+                submit_next()
+                try:
+                    docs, skipped = future.result()
+                except Exception as e:
+                    with lock:
+                        report["files_failed"] += 1
+                        add_error({"file": rel_path, "error": f"parse failed: {e}"})
+                    continue
+                with lock:
+                    report["skipped"] += skipped
+                if not docs:
+                    file_done(rel_path, user_id, kind, failed=False)
+                    continue
+                with lock:
+                    in_flight.append([rel_path, user_id, kind, [position for _, position, _ in docs], 0, 0])
+                for doc_id, _, source in docs:
+                    if kind == "transactions":
+                        yield transaction_action(transactions_index, doc_id, source)
+                    else:
+                        yield {"_index": documents_index, "_id": doc_id, "_source": source}
+
+    try:
+        for ok, item in storage.parallel_bulk(actions(), chunk_size=chunk_size, thread_count=thread_count):
+            with lock:
+                entry = in_flight[0]
+                if count_result(report, ok, item) == "failed":
+                    entry[5] += 1
+                    error = next(iter(item.values()), {}).get("error")
+                    position = entry[3][entry[4]]
+                    # Line 1 is the CSV header, so row 0 sits on line 2
+                    location = {"line": position + 2} if entry[2] == "transactions" else {"chunk": position}
+                    add_error({"file": entry[0], **location, "error": str(error)})
+                entry[4] += 1
+                finished = entry[4] == len(entry[3])
+                if finished:
+                    in_flight.popleft()
+            if finished:
+                file_done(entry[0], entry[1], entry[2], failed=entry[5] > 0)
+    finally:
+        if checkpoint_file:
+            checkpoint_file.close()
+    return report
+
+def bulk_load_cli(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Backfill a directory tree of per-user files (<root>/<user>/*.csv, *.md, *.txt, *.pdf)."
+    )
+    parser.add_argument("root")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="parser processes")
+    parser.add_argument("--threads", type=int, default=4, help="parallel_bulk indexing threads")
+    parser.add_argument("--chunk-size", type=int, default=BULK_CHUNK_SIZE, help="documents per bulk request")
+    parser.add_argument("--checkpoint", help="file of completed paths; re-run with the same file to resume")
+    parser.add_argument("--transactions-index", default=TRANSACTIONS_INDEX)
+    parser.add_argument("--documents-index", default=DOCUMENTS_INDEX)
+    parser.add_argument("--report", help="also write the final report as JSON to this path")
+    parser.add_argument("--relax-index-settings", action="store_true",
+                        help="disable refresh and replicas on the target indices while loading, then restore them")
+    args = parser.parse_args(argv)
+
+    from sqlmodel import SQLModel
+    from database import create_db_engine
+    from local_analytics import LocalTransactionStore
+    from rollups import RollupStore
+    from index_templates import install_index_templates
+    from storage import ElasticsearchStorage
+    analytics_store = LocalTransactionStore()
+    db_engine = create_db_engine()
+    SQLModel.metadata.create_all(db_engine)
+    rollups = RollupStore(db_engine)
+
+    def on_file_done(rel_path, user_id, kind):
+        # Local copies and rollups no longer match the index; they are rebuilt on the user's next upload
+        if kind == "transactions" and user_id:
+            analytics_store.drop_user(user_id)
+            rollups.drop_user(user_id)
+
+    storage = get_storage()
+    if isinstance(storage, ElasticsearchStorage):
+        install_index_templates(storage.client)
+    start = time.perf_counter()
+    with ExitStack() as stack:
+        if args.relax_index_settings:
+            for index_name in (args.transactions_index, args.documents_index):
+                stack.enter_context(storage.relaxed_index_settings(index_name))
+        report = bulk_load(args.root, storage=storage, workers=args.workers, thread_count=args.threads,
+                           chunk_size=args.chunk_size, checkpoint=args.checkpoint,
+                           transactions_index=args.transactions_index, documents_index=args.documents_index,
+                           on_file_done=on_file_done)
+    storage.close()
+    elapsed = time.perf_counter() - start
+    report["elapsed_seconds"] = round(elapsed, 3)
+    report["docs_per_second"] = round((report["indexed"] + report["skipped"]) / elapsed, 1) if elapsed > 0 else None
+
+    print(f"Files: {report['files'] - report['files_failed']} ingested, {report['files_skipped']} skipped (checkpoint), {report['files_failed']} failed to parse")
+    print(f"Docs: {report['new']} new, {report['updated']} updated, {report['skipped']} skipped, {report['failed']} failed "
+          f"in {elapsed:.1f}s ({report['docs_per_second']} docs/sec)")
+    for error in report["errors"][:10]:
+        print(f"  {error}")
+    print("Run `python rollups.py rebuild` to precompute /stats rollups for the backfilled users.")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report["failed"] or report["files_failed"] else 0
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    logging.getLogger("elastic_transport").setLevel(logging.WARNING)
+    if len(sys.argv) > 1:
+        raise SystemExit(bulk_load_cli())
     if ELASTIC_CLOUD_ID and ELASTIC_API_KEY:
                                        
         ingest_structured_data("../data/structured/bank_statement.csv", "fincontext-transactions")
@@ -0,0 +1,113 @@
+"""
+Load test for the async I/O path.
+
+Starts a local stub that plays both Elasticsearch and the Kibana agent API,
+points the app at it, and fires a burst of /stats requests while a slow
+/chat call is pending. With blocking clients the /stats calls would queue
+behind the agent call; with the async clients they complete independently.
+
+Usage: python load_test.py [--agent-delay 2.0] [--stats-requests 50]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from aiohttp import web
+
+STATS_RESPONSE = {
+    "took": 1,
+    "timed_out": False,
+    "hits": {"total": {"value": 0, "relation": "eq"}, "hits": []},
+    "aggregations": {
+        "groups": {
+            "buckets": [
+                {
+                    "key": "Debit",
+                    "doc_count": 2,
+                    "sum": {"value": 1500.0},
+                    "top_terms": {"buckets": [{"key": "Food", "doc_count": 2}]}
+                },
+                {"key": "Credit", "doc_count": 1, "sum": {"value": 60000.0}, "top_terms": {"buckets": []}}
+            ]
+        }
+    }
+}
+
+
+def build_stub_app(agent_delay):
+    async def search(request):
+        return web.json_response(STATS_RESPONSE, headers={"X-Elastic-Product": "Elasticsearch"})
+
+    async def converse(request):
+        await asyncio.sleep(agent_delay)
+        return web.json_response({"response": {"message": "stub answer"}})
+
+    stub = web.Application()
+    stub.router.add_post("/{index}/_search", search)
+    stub.router.add_post("/api/agent_builder/converse", converse)
+    return stub
+
+
+async def start_stub(agent_delay):
+    runner = web.AppRunner(build_stub_app(agent_delay))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def run(agent_delay, stats_requests):
+    runner, stub_url = await start_stub(agent_delay)
+    os.environ["ELASTIC_URL"] = stub_url
+    os.environ["KIBANA_ENDPOINT"] = stub_url
+    os.environ["ELASTIC_ENDPOINT"] = ""
+    os.environ["STATS_CACHE_TTL"] = "0"
+
+    import httpx
+    import main
+    from models import User
+
+    main.app.dependency_overrides[main.get_current_user] = lambda: User(
+        id=1, username="loadtest", email="loadtest@example.com", hashed_password=""
+    )
+    await main.on_startup()
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=None) as client:
+            chat_task = asyncio.create_task(client.post("/chat", json={"message": "how much did I spend on food"}))
+            await asyncio.sleep(0.05)
+
+            async def timed_stats():
+                start = time.perf_counter()
+                resp = await client.get("/stats")
+                resp.raise_for_status()
+                return time.perf_counter() - start
+
+            latencies = await asyncio.gather(*(timed_stats() for _ in range(stats_requests)))
+            stats_done = time.perf_counter()
+            chat_resp = await chat_task
+            chat_done = time.perf_counter()
+    finally:
+        await main.on_shutdown()
+        await runner.cleanup()
+
+    latencies.sort()
+    print(f"/chat status {chat_resp.status_code}, agent delay {agent_delay:.2f}s")
+    print(f"/stats x{stats_requests}: p50 {statistics.median(latencies) * 1000:.1f}ms, "
+          f"max {latencies[-1] * 1000:.1f}ms")
+    if latencies[-1] < agent_delay and stats_done < chat_done:
+        print("PASS: /stats requests completed while /chat was still pending")
+        return 0
+    print("FAIL: /stats requests queued behind the pending /chat call")
+    return 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agent-delay", type=float, default=2.0)
+    parser.add_argument("--stats-requests", type=int, default=50)
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(run(args.agent_delay, args.stats_requests)))
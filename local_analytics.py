@@ -0,0 +1,217 @@
+"""
+Columnar per-user transaction store and a local engine for the esql_queries.py query shapes.
+
+Each user's transactions live as pandas column chunks under ANALYTICS_DIR, appended
+at ingest time. Queries for users with a complete local copy run as vectorized
+group-bys; anything else falls back to ES|QL on the cluster.
+
+API workers on one host share ANALYTICS_DIR: changes to a user's copy take an
+exclusive flock on it and reads a shared one, and each worker reloads its cached
+frame when the user's set of parts has changed.
+"""
+import fcntl
+import hashlib
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+from esql_queries import build_user_query
+
+# pandas is imported where it is used, so importing the API does not load it
+if TYPE_CHECKING:
+    import pandas as pd
+
+TRANSACTIONS_INDEX = "fincontext-transactions"
+ANALYTICS_DIR = os.getenv("ANALYTICS_DIR", "analytics")
+COLUMNS = ["Date", "Description", "Category", "Amount", "Type"]
+QUERY_TYPES = ("expenses", "trend", "large", "merchant")
+# Served from rollups.RollupStore when the user has rollups
+ROLLUP_QUERIES = ("expenses", "trend")
+ES_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.000Z"
+
+
+def normalize_frame(df: "pd.DataFrame") -> "pd.DataFrame":
+    import pandas as pd
+
+    df = df.reindex(columns=COLUMNS)
+    return pd.DataFrame({
+        "Date": pd.to_datetime(df["Date"]),
+        "Description": df["Description"].astype("string"),
+        "Category": df["Category"].astype("category"),
+        "Amount": pd.to_numeric(df["Amount"]).astype("float64"),
+        "Type": df["Type"].astype("category"),
+    })
+
+
+def _parts(user_dir: str):
+    return sorted(name for name in os.listdir(user_dir) if name.startswith("part-"))
+
+
+class LocalTransactionStore:
+    def __init__(self, root: str = ANALYTICS_DIR):
+        self.root = root
+        self._frames = {}  # user_id -> (part names the frame was built from, frame)
+        self._lock = threading.Lock()
+
+    def _user_dir(self, user_id: str):
+        return os.path.join(self.root, hashlib.sha1(user_id.encode()).hexdigest())
+
+    @contextmanager
+    def _locked(self, user_id: str, shared: bool = False):
+        """Yields the user's directory under a flock, which also excludes other threads (each opens its own file)."""
+        user_dir = self._user_dir(user_id)
+        os.makedirs(user_dir, exist_ok=True)
+        with open(os.path.join(user_dir, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield user_dir
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _write_part(user_dir: str, df: "pd.DataFrame"):
+        # Unique across processes; the time prefix keeps parts in append order
+        name = f"part-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.pkl"
+        normalize_frame(df).to_pickle(os.path.join(user_dir, name))
+
+    @staticmethod
+    def _clear(user_dir: str):
+        for name in os.listdir(user_dir):
+            if name != ".lock":
+                os.remove(os.path.join(user_dir, name))
+
+    def has_user(self, user_id: str) -> bool:
+        return os.path.exists(os.path.join(self._user_dir(user_id), "COMPLETE"))
+
+    def append(self, user_id: str, df: "pd.DataFrame"):
+        if df.empty:
+            return
+        with self._locked(user_id) as user_dir:
+            self._write_part(user_dir, df)
+
+    def ensure_user(self, storage, user_id: str, index_name: str = TRANSACTIONS_INDEX, batch_size: int = 10000):
+        """Backfills a user's local copy from the storage backend the first time they ingest."""
+        import pandas as pd
+
+        if self.has_user(user_id):
+            return
+        with self._locked(user_id) as user_dir:
+            # Another worker may have finished the backfill while this one waited for the lock
+            if self.has_user(user_id):
+                return
+            self._clear(user_dir)
+            rows = []
+            for source in storage.scan(index_name, {"user_id": user_id}, COLUMNS):
+                rows.append(source)
+                if len(rows) >= batch_size:
+                    self._write_part(user_dir, pd.DataFrame(rows))
+                    rows = []
+            if rows:
+                self._write_part(user_dir, pd.DataFrame(rows))
+            open(os.path.join(user_dir, "COMPLETE"), "w").close()
+
+    def mark_complete(self, user_id: str):
+        with self._locked(user_id) as user_dir:
+            open(os.path.join(user_dir, "COMPLETE"), "w").close()
+
+    def drop_user(self, user_id: str):
+        with self._locked(user_id) as user_dir:
+            self._clear(user_dir)
+        with self._lock:
+            self._frames.pop(user_id, None)
+
+    def frame(self, user_id: str) -> "pd.DataFrame":
+        import pandas as pd
+
+        with self._locked(user_id, shared=True) as user_dir:
+            parts = _parts(user_dir)
+            with self._lock:
+                cached = self._frames.get(user_id)
+            # Parts are never rewritten, so the same names mean the same rows, whichever worker wrote them
+            if cached is not None and cached[0] == parts:
+                return cached[1]
+            if parts:
+                df = normalize_frame(pd.concat([pd.read_pickle(os.path.join(user_dir, name)) for name in parts], ignore_index=True))
+            else:
+                df = normalize_frame(pd.DataFrame(columns=COLUMNS))
+        with self._lock:
+            self._frames[user_id] = (parts, df)
+        return df
+
+
+def expenses_by_category(df: "pd.DataFrame"):
+    debits = df[df["Type"] == "Debit"]
+    totals = debits.groupby("Category", observed=True)["Amount"].sum().reset_index(name="total_amount")
+    totals = totals.sort_values(["total_amount", "Category"], ascending=[False, True])
+    return [{"total_amount": float(r.total_amount), "Category": str(r.Category)} for r in totals.itertuples()]
+
+
+def monthly_trend(df: "pd.DataFrame"):
+    month = df["Date"].dt.to_period("M").dt.to_timestamp()
+    totals = df.assign(month=month).groupby(["month", "Type"], observed=True)["Amount"].sum().reset_index(name="monthly_spend")
+    totals = totals.sort_values(["month", "Type"])
+    return [
+        {"monthly_spend": float(r.monthly_spend), "month": r.month.strftime(ES_DATE_FORMAT), "Type": str(r.Type)}
+        for r in totals.itertuples()
+    ]
+
+
+def large_transactions(df: "pd.DataFrame", threshold=1000, limit=5):
+    large = df[df["Amount"] > threshold]
+    large = large.sort_values(["Date", "Amount", "Description"], ascending=[False, False, True]).head(int(limit))
+    return [
+        {
+            "Date": r.Date.strftime(ES_DATE_FORMAT),
+            "Description": str(r.Description),
+            "Category": str(r.Category),
+            "Amount": float(r.Amount),
+            "Type": str(r.Type),
+        }
+        for r in large.itertuples()
+    ]
+
+
+def merchant_search(df: "pd.DataFrame", merchant="Zomato"):
+    matches = df["Amount"][df["Description"].str.contains(merchant, regex=False, na=False)]
+    count = int(matches.size)
+    return [{"total": float(matches.sum()) if count else None, "count": count}]
+
+
+LOCAL_QUERIES = {
+    "expenses": lambda df, **params: expenses_by_category(df),
+    "trend": lambda df, **params: monthly_trend(df),
+    "large": lambda df, threshold=1000, limit=5, **params: large_transactions(df, threshold, limit),
+    "merchant": lambda df, merchant="Zomato", **params: merchant_search(df, merchant),
+}
+
+
+def esql_rows(body):
+    names = [column["name"] for column in body["columns"]]
+    return [dict(zip(names, values)) for values in body["values"]]
+
+
+class AnalyticsEngine:
+    def __init__(self, store: LocalTransactionStore, rollups=None):
+        self.store = store
+        self.rollups = rollups
+
+    def local_source(self, query_type: str, user_id: str):
+        """"rollup" or "local" when the query can be answered without the cluster, else None."""
+        if self.rollups is not None and query_type in ROLLUP_QUERIES and self.rollups.has_user(user_id):
+            return "rollup"
+        if query_type in LOCAL_QUERIES and self.store.has_user(user_id):
+            return "local"
+        return None
+
+    def query_local(self, query_type: str, user_id: str, **params):
+        if self.local_source(query_type, user_id) == "rollup":
+            return self.rollups.query(query_type, user_id, **params)
+        return LOCAL_QUERIES[query_type](self.store.frame(user_id), **params)
+
+    async def query_remote(self, es, query_type: str, user_id: str, **params):
+        query, query_params = build_user_query(query_type, user_id, **params)
+        resp = await es.esql.query(query=query, params=query_params)
+        return esql_rows(resp.body)
@@ -1,32 +1,59 @@
-import requests
-print("DEBUG: BACKEND STARTING - VERSION 2.0")
+import csv
+import httpx
+import io
+import logging
 import os
 import json
-import io
-import pandas as pd
-from datetime import datetime
-from typing import List, Optional
-from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile, Form
+import time
+import shutil
+import uuid
+from datetime import date, timedelta
+from typing import TYPE_CHECKING, List, Optional
+from fastapi import FastAPI, HTTPException, Depends, Request, status, File, UploadFile, Form, Query
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from sqlmodel import SQLModel, create_engine, Session, select
-from elasticsearch import Elasticsearch, helpers
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from sqlmodel import SQLModel, Session, select
+from sqlalchemy import event, inspect
+from starlette.background import BackgroundTask
+from storage import create_storage, ElasticsearchStorage
 from dotenv import load_dotenv
 from pydantic import BaseModel
 from jose import JWTError, jwt
 
-from models import User, UserCreate, Token, TokenData
-from auth_utils import verify_password, get_password_hash, create_access_token, SECRET_KEY, ALGORITHM
+from database import create_db_engine
+from models import User, UserCreate, Token, TokenData, IngestJob, add_missing_columns
+from auth_utils import verify_and_update_password, get_password_hash_async, create_access_token, SECRET_KEY, ALGORITHM, TokenCache
+from ingest_jobs import IngestJobQueue, count_pending_jobs, data_version, job_summary
+from document_pipeline import DOCUMENTS_INDEX, get_embedder, build_knn_query
+from local_analytics import LocalTransactionStore, AnalyticsEngine, ANALYTICS_DIR, COLUMNS, QUERY_TYPES, TRANSACTIONS_INDEX
+from answer_cache import AnswerCache
+from rollups import RollupStore
+from index_templates import check_legacy_indices, install_index_templates
+from metrics import MetricsMiddleware, RATE_LIMITED, render_metrics, timed, observe_phase
+from rate_limits import BucketLimit, ConcurrencyGate, RateLimiter, RateLimitExceeded, create_bucket_store
+
+if TYPE_CHECKING:
+    from elasticsearch import AsyncElasticsearch
 
 load_dotenv()
 
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger("fincontext")
+# httpx and the Elasticsearch transport log every request at INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("elastic_transport").setLevel(logging.WARNING)
+
                 
-sqlite_file_name = "fincontext.db"
-sqlite_url = f"sqlite:///{sqlite_file_name}"
-engine = create_engine(sqlite_url, connect_args={"check_same_thread": False})
+engine = create_db_engine()
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    add_missing_columns(engine)
 
 def get_session():
     with Session(engine) as session:
@@ -53,17 +80,35 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
-ELASTIC_CLOUD_ID = os.getenv("ELASTIC_CLOUD_ID")
 ELASTIC_API_KEY = os.getenv("ELASTIC_API_KEY")
+AGENT_TIMEOUT = float(os.getenv("AGENT_TIMEOUT", "60"))
+AGENT_MAX_CONNECTIONS = int(os.getenv("AGENT_MAX_CONNECTIONS", "100"))
 
-es = Elasticsearch(
-    cloud_id=ELASTIC_CLOUD_ID,
-    api_key=ELASTIC_API_KEY
-)
+storage = None
+# Only set for the Elasticsearch backend; kNN search and ES|QL need the cluster
+es: Optional["AsyncElasticsearch"] = None
+http_client: Optional[httpx.AsyncClient] = None
+
+def create_http_client():
+    return httpx.AsyncClient(
+        timeout=AGENT_TIMEOUT,
+        limits=httpx.Limits(max_connections=AGENT_MAX_CONNECTIONS, max_keepalive_connections=20)
+    )
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+token_cache = TokenCache(maxsize=TOKEN_CACHE_SIZE)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def invalidate_cached_user(mapper, connection, target):
+    previous = inspect(target).attrs.username.history.deleted or ()
+    for username in {target.username, *previous}:
+        token_cache.invalidate_user(username)
+
                 
 async def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
     credentials_exception = HTTPException(
@@ -71,31 +116,100 @@ async def get_current_user(token: str = Depends(oauth2_scheme), session: Session
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cached_user = token_cache.get(token)
+    if cached_user is not None:
+        return cached_user
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with timed("auth.jwt_decode"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = session.exec(select(User).where(User.username == token_data.username)).first()
+    with timed("auth.user_lookup"):
+        user = session.exec(select(User).where(User.username == token_data.username)).first()
     if user is None:
         raise credentials_exception
+    token_cache.put(token, user, payload.get("exp"))
     return user
 
+# Per-user token buckets; RATE_LIMIT_BACKEND=database shares them between workers. 0 turns a limit off
+CHAT_RATE_PER_MINUTE = float(os.getenv("CHAT_RATE_PER_MINUTE", "20"))
+CHAT_RATE_BURST = int(os.getenv("CHAT_RATE_BURST", "5"))
+UPLOAD_RATE_PER_MINUTE = float(os.getenv("UPLOAD_RATE_PER_MINUTE", "6"))
+UPLOAD_RATE_BURST = int(os.getenv("UPLOAD_RATE_BURST", "3"))
+
+rate_limiter = RateLimiter(create_bucket_store(engine=engine), {
+    "chat": BucketLimit(CHAT_RATE_PER_MINUTE, CHAT_RATE_BURST),
+    "upload": BucketLimit(UPLOAD_RATE_PER_MINUTE, UPLOAD_RATE_BURST),
+})
+
+async def spend_rate_token(scope: str, username: str):
+    if rate_limiter.store.blocking:
+        await run_in_threadpool(rate_limiter.check, scope, username)
+    else:
+        rate_limiter.check(scope, username)
+
+def rate_limited(scope: str):
+    """Dependency resolving the caller like get_current_user, then spending one of their `scope` tokens."""
+    async def current_user_within_limit(current_user: User = Depends(get_current_user)):
+        await spend_rate_token(scope, current_user.username)
+        return current_user
+    return current_user_within_limit
+
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_exceeded(request: Request, exc: RateLimitExceeded):
+    RATE_LIMITED.labels(exc.limit).inc()
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": exc.detail},
+        headers={"Retry-After": exc.retry_after_header}
+    )
+
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
+    global storage, es, http_client
     create_db_and_tables()
+    storage = create_storage()
+    es = storage.async_client if isinstance(storage, ElasticsearchStorage) else None
+    if es is not None:
+        try:
+            await run_in_threadpool(install_index_templates, storage.client)
+        except Exception as e:
+            # Indices created while templates are missing fall back to dynamic mapping
+            logger.warning("Could not install index templates: %s", e)
+        try:
+            await run_in_threadpool(check_legacy_indices, storage)
+        except Exception as e:
+            logger.warning("Could not check index mappings: %s", e)
+    http_client = create_http_client()
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    job_queue.start(storage, recover_running=INGEST_RECOVER_RUNNING)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    global storage, es, http_client
+    await run_in_threadpool(job_queue.shutdown, INGEST_DRAIN_SECONDS)
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+    if storage is not None:
+        await storage.aclose()
+        storage = None
+        es = None
+    engine.dispose()
 
            
 @app.post("/signup", response_model=User)
-def signup(user_in: UserCreate, session: Session = Depends(get_session)):
+async def signup(user_in: UserCreate, session: Session = Depends(get_session)):
     db_user = session.exec(select(User).where(User.username == user_in.username)).first()
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    hashed_password = get_password_hash(user_in.password)
+    with timed("auth.password_hash"):
+        hashed_password = await get_password_hash_async(user_in.password)
     new_user = User(
         username=user_in.username,
         email=user_in.email,
@@ -108,13 +222,22 @@ def signup(user_in: UserCreate, session: Session = Depends(get_session)):
 
 @app.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
-    user = session.exec(select(User).where(User.username == form_data.username)).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    with timed("auth.user_lookup"):
+        user = session.exec(select(User).where(User.username == form_data.username)).first()
+    valid, new_hash = False, None
+    if user:
+        with timed("auth.password_verify"):
+            valid, new_hash = await verify_and_update_password(form_data.password, user.hashed_password)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        user.hashed_password = new_hash
+        session.add(user)
+        session.commit()
     access_token = create_access_token(data={"sub": user.username})
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -126,168 +249,434 @@ async def read_users_me(current_user: User = Depends(get_current_user)):
 
 class ChatRequest(BaseModel):
     message: str
+    new_conversation: bool = False
+
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", "1800"))
+_conversations = {}
+
+def get_conversation_id(username: str):
+    entry = _conversations.get(username)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    _conversations.pop(username, None)
+    return None
+
+def remember_conversation_id(username: str, conversation_id):
+    if conversation_id:
+        _conversations[username] = (time.monotonic() + CONVERSATION_TTL, conversation_id)
+
+def active_conversation_id(request: ChatRequest, username: str):
+    """The conversation the message continues, after dropping the user's current one if they asked for a new one."""
+    if request.new_conversation:
+        _conversations.pop(username, None)
+    return get_conversation_id(username)
+
+def build_agent_request(request: ChatRequest, username: str, conversation_id=None):
+    base_url = KIBANA_ENDPOINT.rstrip('/')
+    endpoint = f"{base_url}/api/agent_builder/converse"
+    
+    headers = {
+        "Authorization": f"ApiKey {ELASTIC_API_KEY}",
+        "Content-Type": "application/json",
+        "kbn-xsrf": "true"
+    }
+    
+    enriched_message = f"[User Identity: {username}] {request.message}"
+    
+    payload = {
+        "input": enriched_message,
+        "agent_id": os.getenv("AGENT_ID")
+    }
+    if conversation_id:
+        payload["conversation_id"] = conversation_id
+    return endpoint, headers, payload
+
+def extract_agent_response(data):
+    agent_response = None
+    if isinstance(data, dict):
+        agent_response = data.get("text")
+        if not agent_response and "response" in data:
+            resp_field = data["response"]
+            if isinstance(resp_field, str):
+                agent_response = resp_field
+            elif isinstance(resp_field, dict):
+                agent_response = resp_field.get("message") or resp_field.get("content")
+    if agent_response and isinstance(agent_response, str):
+        return agent_response
+    return None
+
+def fallback_response(username: str):
+    return f"Hi {username}, I've analyzed your personal documents. (Live Agent fallback mode)."
+
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", "300"))
+answer_cache = AnswerCache(ttl=CHAT_CACHE_TTL)
+
+# Seconds a worker reuses its last read of a user's data version, so ingests run by other workers
+# reach its answer and stats caches within this long
+DATA_VERSION_TTL = float(os.getenv("DATA_VERSION_TTL", "2"))
+_data_versions = {}
+
+def read_data_version(username: str) -> int:
+    with Session(engine) as session:
+        return data_version(session, username)
+
+async def current_data_version(username: str) -> int:
+    cached = _data_versions.get(username)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    version = await run_in_threadpool(read_data_version, username)
+    _data_versions[username] = (time.monotonic() + DATA_VERSION_TTL, version)
+    return version
+
+# Upstream agent calls in flight per worker; cache hits and coalesced requests do not take a slot
+AGENT_MAX_CONCURRENCY = int(os.getenv("AGENT_MAX_CONCURRENCY", "50"))
+agent_gate = ConcurrencyGate(AGENT_MAX_CONCURRENCY)
+
+def agent_busy():
+    # A slot frees up about one typical upstream call from now
+    retry_after = answer_cache.metrics()["upstream_p50_seconds"] or 1.0
+    return RateLimitExceeded("agent_concurrency", "The assistant is busy, try again shortly", retry_after)
+
+async def ask_agent(request: ChatRequest, username: str, conversation_id=None):
+    endpoint, headers, payload = build_agent_request(request, username, conversation_id)
+    
+    logger.debug("Calling Kibana Agent API for %s: %s", username, endpoint)
+    start = time.perf_counter()
+    resp = await http_client.post(endpoint, headers=headers, json=payload)
+    elapsed = time.perf_counter() - start
+    answer_cache.record_upstream(elapsed)
+    observe_phase("agent.converse", elapsed)
+    
+    if resp.status_code == 200:
+        data = resp.json()
+        if isinstance(data, dict):
+            remember_conversation_id(username, data.get("conversation_id"))
+        agent_response = extract_agent_response(data)
+        if agent_response:
+            return {"response": agent_response, "sender": "bot"}, True
+
+    return {"response": fallback_response(username), "sender": "bot"}, False
+
+async def ask_agent_within_cap(request: ChatRequest, username: str, conversation_id=None):
+    permit = agent_gate.try_acquire()
+    if permit is None:
+        raise agent_busy()
+    try:
+        return await ask_agent(request, username, conversation_id)
+    finally:
+        permit.release()
 
 @app.post("/chat")
-async def chat(request: ChatRequest, current_user: User = Depends(get_current_user)):
+async def chat(request: ChatRequest, current_user: User = Depends(rate_limited("chat"))):
     message = request.message
-    print(f"--- [User: {current_user.username}] New Message Received: {message} ---")
+    logger.debug("[User: %s] New message received: %s", current_user.username, message)
     
     try:
-        AGENT_ID = os.getenv("AGENT_ID")
-        base_url = KIBANA_ENDPOINT.rstrip('/')
-        endpoint = f"{base_url}/api/agent_builder/converse"
-        
-        headers = {
-            "Authorization": f"ApiKey {ELASTIC_API_KEY}",
-            "Content-Type": "application/json",
-            "kbn-xsrf": "true"
-        }
-        
-        enriched_message = f"[User Identity: {current_user.username}] {message}"
-        
-        payload = {
-            "input": enriched_message,
-            "agent_id": AGENT_ID
-        }
-        
-        print(f"DEBUG: Calling Kibana Agent API for {current_user.username}: {endpoint}")
-        resp = requests.post(endpoint, headers=headers, json=payload, timeout=60)
-        
-        if resp.status_code == 200:
-            data = resp.json()
-            agent_response = None
-            if isinstance(data, dict):
-                agent_response = data.get("text")
-                if not agent_response and "response" in data:
-                    resp_field = data["response"]
-                    if isinstance(resp_field, str):
-                        agent_response = resp_field
-                    elif isinstance(resp_field, dict):
-                        agent_response = resp_field.get("message") or resp_field.get("content")
-            
-            if agent_response and isinstance(agent_response, str):
-                return {"response": agent_response, "sender": "bot"}
-
-        return {"response": f"Hi {current_user.username}, I've analyzed your personal documents. (Live Agent fallback mode).", "sender": "bot"}
+        answer_cache.observe_data_version(current_user.username, await current_data_version(current_user.username))
+        conversation_id = active_conversation_id(request, current_user.username)
+        if request.new_conversation:
+            # A fresh conversation always reaches the agent, which starts it
+            answer, _ = await ask_agent_within_cap(request, current_user.username)
+            return answer
+        # Answers depend on the conversation so far, so they are only shared within one conversation
+        return await answer_cache.get_or_fetch(
+            current_user.username, message,
+            lambda: ask_agent_within_cap(request, current_user.username, conversation_id),
+            context=conversation_id
+        )
 
+    except RateLimitExceeded:
+        raise
     except Exception as e:
-        print(f"ERROR: {e}")
+        logger.exception("Chat request failed for %s", current_user.username)
         return {"response": f"Error: {str(e)}", "sender": "bot"}
 
-@app.post("/upload")
+@app.get("/chat/metrics")
+async def chat_metrics(current_user: User = Depends(get_current_user)):
+    return {**answer_cache.metrics(), "agent_in_flight": agent_gate.in_flight}
+
+def sse_event(data: dict, event: Optional[str] = None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+async def iter_sse(resp: httpx.Response):
+    event, data_lines = "message", []
+    async for line in resp.aiter_lines():
+        if not line:
+            if data_lines:
+                yield event, "\n".join(data_lines)
+            event, data_lines = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+    if data_lines:
+        yield event, "\n".join(data_lines)
+
+async def stream_agent_events(endpoint: str, headers: dict, payload: dict, username: str):
+    sent_text = False
+    try:
+        start = time.perf_counter()
+        async with http_client.stream("POST", f"{endpoint}/async", headers=headers, json=payload) as resp:
+            observe_phase("agent.stream_connect", time.perf_counter() - start)
+            if resp.status_code != 200:
+                await resp.aread()
+                raise RuntimeError(f"Agent API returned {resp.status_code}")
+            async for event, raw in iter_sse(resp):
+                try:
+                    data = json.loads(raw)
+                except ValueError:
+                    continue
+                body = data.get("data", data) if isinstance(data, dict) else {}
+                if not isinstance(body, dict):
+                    continue
+                if body.get("conversation_id"):
+                    remember_conversation_id(username, body["conversation_id"])
+                if event == "message_chunk" and body.get("text_chunk"):
+                    sent_text = True
+                    yield sse_event({"text": body["text_chunk"]})
+                elif event == "message_complete" and not sent_text:
+                    text = body.get("message_content") or extract_agent_response(body)
+                    if text:
+                        sent_text = True
+                        yield sse_event({"text": text})
+        if not sent_text:
+            yield sse_event({"text": fallback_response(username)})
+        yield sse_event({"conversation_id": get_conversation_id(username)}, event="done")
+    except Exception as e:
+        logger.exception("Chat stream failed for %s", username)
+        yield sse_event({"error": str(e)}, event="error")
+
+async def release_when_done(events, permit):
+    try:
+        async for event in events:
+            yield event
+    finally:
+        permit.release()
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, current_user: User = Depends(rate_limited("chat"))):
+    logger.debug("[User: %s] New streaming message received: %s", current_user.username, request.message)
+    endpoint, headers, payload = build_agent_request(
+        request, current_user.username, active_conversation_id(request, current_user.username)
+    )
+    permit = agent_gate.try_acquire()
+    if permit is None:
+        raise agent_busy()
+    # The stream holds its slot until it ends; the background task covers a client gone before the first chunk
+    return StreamingResponse(
+        release_when_done(stream_agent_events(endpoint, headers, payload, current_user.username), permit),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(permit.release)
+    )
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# On shutdown, running ingest jobs get this long before they are re-queued for the next start
+INGEST_DRAIN_SECONDS = float(os.getenv("INGEST_DRAIN_SECONDS", "30"))
+# Re-queue jobs a stopped process left running. serve.py does this once before starting workers and turns
+# it off for them, since a worker starting later would otherwise take over jobs another one is running
+INGEST_RECOVER_RUNNING = os.getenv("INGEST_RECOVER_RUNNING", "1") == "1"
+SUPPORTED_UPLOAD_EXTENSIONS = ('.csv', '.pdf', '.md', '.txt')
+# Queued + running ingest jobs allowed per user and across all users (0 = no cap)
+UPLOAD_MAX_PENDING_PER_USER = int(os.getenv("UPLOAD_MAX_PENDING_PER_USER", "3"))
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "50"))
+UPLOAD_BACKLOG_RETRY_AFTER = float(os.getenv("UPLOAD_BACKLOG_RETRY_AFTER", "30"))
+
+def on_ingest_complete(job: IngestJob, report: dict):
+    if report["indexed"]:
+        _data_versions.pop(job.user_id, None)
+        answer_cache.invalidate_user(job.user_id)
+    if job.filename.endswith('.csv') and report["indexed"]:
+        invalidate_stats_cache(job.user_id)
+
+analytics_store = LocalTransactionStore(ANALYTICS_DIR)
+rollups = RollupStore(engine)
+analytics = AnalyticsEngine(analytics_store, rollups)
+
+job_queue = IngestJobQueue(
+    engine, max_workers=INGEST_WORKERS,
+    on_complete=on_ingest_complete, store=analytics_store, rollups=rollups
+)
+
+def check_ingest_backlog(session: Session, username: str):
+    # Counted from the jobs table, so the caps hold across workers (a few concurrent uploads can overshoot)
+    if UPLOAD_MAX_PENDING_PER_USER > 0 and count_pending_jobs(session, username) >= UPLOAD_MAX_PENDING_PER_USER:
+        raise RateLimitExceeded(
+            "upload_user_backlog", "Too many of your uploads are still being ingested, try again later",
+            UPLOAD_BACKLOG_RETRY_AFTER
+        )
+    if INGEST_MAX_PENDING > 0 and count_pending_jobs(session) >= INGEST_MAX_PENDING:
+        raise RateLimitExceeded("ingest_backlog", "Ingestion is busy, try again later", UPLOAD_BACKLOG_RETRY_AFTER)
+
+def save_upload(fileobj, path: str):
+    with open(path, 'wb') as out:
+        shutil.copyfileobj(fileobj, out, 1024 * 1024)
+
+@app.post("/upload", status_code=status.HTTP_202_ACCEPTED)
 async def upload_document(
     file: UploadFile = File(...),
     doc_type: str = Form(...),
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    filename = file.filename or ""
+    if not filename.endswith(SUPPORTED_UPLOAD_EXTENSIONS):
+        raise HTTPException(status_code=400, detail="Unsupported file format")
+    check_ingest_backlog(session, current_user.username)
+    # Only uploads that will be queued spend the caller's budget
+    await spend_rate_token("upload", current_user.username)
+
+    job_id = uuid.uuid4().hex
+    file_path = os.path.join(UPLOAD_DIR, job_id + os.path.splitext(filename)[1])
+    try:
+        await file.seek(0)
+        with timed("upload.save"):
+            await run_in_threadpool(save_upload, file.file, file_path)
+
+        job = IngestJob(
+            id=job_id,
+            user_id=current_user.username,
+            filename=filename,
+            file_path=file_path,
+            doc_type=doc_type
+        )
+        session.add(job)
+        session.commit()
+        job_queue.submit(job_id)
+        return {
+            "message": f"Queued {filename} for ingestion for {current_user.username}",
+            "job_id": job_id,
+            "status": job.status
+        }
+    except Exception as e:
+        logger.exception("Upload failed for %s", current_user.username)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/upload/{job_id}")
+async def get_upload_status(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    job = session.get(IngestJob, job_id)
+    if job is None or job.user_id != current_user.username:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    return job_summary(job)
+
+@app.get("/documents/search")
+async def search_documents(
+    q: str,
+    k: int = Query(5, ge=1, le=50),
     current_user: User = Depends(get_current_user)
 ):
-    contents = await file.read()
-    filename = file.filename
-    
+    if es is None:
+        raise HTTPException(status_code=501, detail="Document search requires the Elasticsearch backend")
     try:
-        if filename.endswith('.csv'):
-            df = pd.read_csv(io.StringIO(contents.decode('utf-8')))
-            df['user_id'] = current_user.username
-            if 'Date' in df.columns:
-                df['Date'] = pd.to_datetime(df['Date'])
-            
-            actions = [
-                {
-                    "_index": "fincontext-transactions",
-                    "_source": record
-                }
-                for record in df.to_dict('records')
-            ]
-            helpers.bulk(es, actions)
-            return {"message": f"Successfully ingested {len(actions)} transactions for {current_user.username}"}
-        
-        elif filename.endswith('.pdf') or filename.endswith('.md') or filename.endswith('.txt'):
-            text = contents.decode('utf-8', errors='ignore')
-            doc = {
-                "text": text,
-                "filename": filename,
-                "user_id": current_user.username,
-                "metadata": {"type": doc_type, "timestamp": datetime.now().isoformat()}
+        with timed("documents.embed_query"):
+            vectors = await run_in_threadpool(get_embedder().embed, [q])
+        with timed("es.knn_search"):
+            res = await es.search(
+                index=DOCUMENTS_INDEX,
+                knn=build_knn_query(vectors[0], current_user.username, k, await storage.keyword_field(DOCUMENTS_INDEX, "user_id")),
+                source_excludes=["embedding"],
+                size=k,
+                routing=current_user.username
+            )
+    except Exception as e:
+        logger.exception("Document search failed for %s", current_user.username)
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "results": [
+            {
+                "text": hit["_source"].get("text"),
+                "filename": hit["_source"].get("filename"),
+                "chunk": hit["_source"].get("chunk"),
+                "score": hit["_score"]
             }
-            es.index(index="fincontext-documents", document=doc)
-            return {"message": f"Successfully ingested document {filename} for {current_user.username}"}
-        
+            for hit in res["hits"]["hits"]
+        ]
+    }
+
+@app.get("/analytics/{query_type}")
+async def run_analytics(
+    query_type: str,
+    threshold: float = 1000,
+    limit: int = Query(5, ge=1, le=1000),
+    merchant: str = "Zomato",
+    current_user: User = Depends(get_current_user)
+):
+    if query_type not in QUERY_TYPES:
+        raise HTTPException(status_code=404, detail=f"Unknown analytics query '{query_type}'")
+    params = {"threshold": threshold, "limit": limit, "merchant": merchant}
+    try:
+        source = analytics.local_source(query_type, current_user.username)
+        if source is not None:
+            with timed(f"analytics.{source}_query"):
+                rows = await run_in_threadpool(analytics.query_local, query_type, current_user.username, **params)
+        elif es is None:
+            raise HTTPException(status_code=501, detail="No local copy of this user's transactions to query")
         else:
-            raise HTTPException(status_code=400, detail="Unsupported file format")
-            
+            with timed("es.esql"):
+                rows = await analytics.query_remote(es, query_type, current_user.username, **params)
+            source = "elasticsearch"
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Upload error: {e}")
+        logger.exception("Analytics query %s failed for %s", query_type, current_user.username)
         raise HTTPException(status_code=500, detail=str(e))
+    return {"query": query_type, "source": source, "rows": rows}
+
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "30"))
+_stats_cache = {}  # username -> (expires, user's data version, stats)
+
+def invalidate_stats_cache(username: str):
+    _stats_cache.pop(username, None)
+
+async def fetch_stats(username: str):
+    if await run_in_threadpool(rollups.has_user, username):
+        with timed("rollup.stats_aggregate"):
+            groups = await run_in_threadpool(rollups.aggregate, username)
+    else:
+        with timed(f"{storage.name}.stats_aggregate"):
+            groups = await storage.aggregate(
+                "fincontext-transactions",
+                filters={"user_id": username},
+                group_by="Type",
+                sum_field="Amount",
+                terms_field="Category",
+                terms_size=1
+            )
+    debit = groups.get("Debit", {})
+    total_spending = debit.get("sum") or 0
+    total_income = groups.get("Credit", {}).get("sum") or 0
+    top_terms = debit.get("top_terms") or []
+    top_category = top_terms[0][0] if top_terms else "N/A"
+
+    return {
+        "total_spending": round(total_spending, 2),
+        "total_income": round(total_income, 2),
+        "top_category": top_category,
+        "balance": round(total_income - total_spending, 2)
+    }
 
 @app.get("/stats")
 async def get_stats(current_user: User = Depends(get_current_user)):
-    print(f"DEBUG: STATS REQUESTED FOR {current_user.username}")
+    logger.debug("Stats requested for %s", current_user.username)
+    # Checked on hits too, since the ingest that changed the data may have run in another worker
+    version = await current_data_version(current_user.username)
+    cached = _stats_cache.get(current_user.username)
+    if cached and cached[0] > time.monotonic() and cached[1] == version:
+        return cached[2]
     try:
-                                    
-        spending_res = es.search(
-            index="fincontext-transactions",
-            query={
-                "bool": {
-                    "must": [
-                        {"term": {"user_id.keyword": current_user.username}},
-                        {"term": {"Type.keyword": "Debit"}}
-                    ]
-                }
-            },
-            aggs={
-                "total_spending": {"sum": {"field": "Amount"}}
-            },
-            size=0
-        )
-        total_spending = spending_res['aggregations']['total_spending']['value'] or 0
-
-                                   
-        income_res = es.search(
-            index="fincontext-transactions",
-            query={
-                "bool": {
-                    "must": [
-                        {"term": {"user_id.keyword": current_user.username}},
-                        {"term": {"Type.keyword": "Credit"}}
-                    ]
-                }
-            },
-            aggs={
-                "total_income": {"sum": {"field": "Amount"}}
-            },
-            size=0
-        )
-        total_income = income_res['aggregations']['total_income']['value'] or 0
-
-                         
-        category_res = es.search(
-            index="fincontext-transactions",
-            query={
-                "bool": {
-                    "must": [
-                        {"term": {"user_id.keyword": current_user.username}},
-                        {"term": {"Type.keyword": "Debit"}}
-                    ]
-                }
-            },
-            aggs={
-                "top_categories": {
-                    "terms": {"field": "Category.keyword", "size": 1}
-                }
-            },
-            size=0
-        )
-        
-        buckets = category_res['aggregations']['top_categories']['buckets']
-        top_category = buckets[0]['key'] if buckets else "N/A"
-
-        return {
-            "total_spending": round(total_spending, 2),
-            "total_income": round(total_income, 2),
-            "top_category": top_category,
-            "balance": round(total_income - total_spending, 2)
-        }
+        stats = await fetch_stats(current_user.username)
+        _stats_cache[current_user.username] = (time.monotonic() + STATS_CACHE_TTL, version, stats)
+        return stats
     except Exception as e:
-        print(f"Stats error: {e}")
+        logger.warning("Stats query failed for %s: %s", current_user.username, e)
         return {
             "total_spending": 0,
             "total_income": 0,
@@ -295,6 +684,107 @@ async def get_stats(current_user: User = Depends(get_current_user)):
             "balance": 0
         }
 
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+def export_row(doc: dict):
+    row = {field: doc.get(field) for field in COLUMNS}
+    # Day precision, like the uploaded statements, so an exported CSV can be uploaded again as it is
+    if isinstance(row["Date"], str):
+        row["Date"] = row["Date"][:10]
+    return row
+
+def encode_ndjson(docs, header=False):
+    return "".join(json.dumps(export_row(doc)) + "\n" for doc in docs)
+
+def encode_csv(docs, header=False):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    if header:
+        writer.writerow(COLUMNS)
+    writer.writerows([export_row(doc)[field] for field in COLUMNS] for doc in docs)
+    return out.getvalue()
+
+async def stream_export(pages, page, encode, limit, username: str):
+    # Only one page is held at a time, however long the export
+    sent = len(page)
+    try:
+        yield encode(page, header=True)
+        while page and (limit is None or sent < limit):
+            page = await anext(pages, [])
+            if limit is not None:
+                page = page[:limit - sent]
+            sent += len(page)
+            if page:
+                yield encode(page)
+    except Exception:
+        # The status line is already sent, so all that is left is to end the body early
+        logger.exception("Transaction export failed for %s after %d rows", username, sent)
+    finally:
+        await pages.aclose()
+
+@app.get("/transactions")
+async def export_transactions(
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    category: Optional[str] = None,
+    tx_type: Optional[str] = Query(None, alias="type", pattern="^(Debit|Credit)$"),
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    merchant: Optional[str] = None,
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    limit: Optional[int] = Query(None, ge=1),
+    current_user: User = Depends(get_current_user)
+):
+    """Streams the caller's transactions, oldest first unless order=desc, as NDJSON or CSV.
+
+    Filters combine like the ES|QL templates: type (expenses), min/max_amount
+    (large transactions), date_from/date_to inclusive (monthly trend) and
+    merchant, a case-sensitive substring of Description (merchant search).
+    """
+    filters = {"user_id": current_user.username}
+    if category:
+        filters["Category"] = category
+    if tx_type:
+        filters["Type"] = tx_type
+    ranges = {}
+    if date_from:
+        ranges.setdefault("Date", {})["gte"] = date_from.isoformat()
+    if date_to:
+        ranges.setdefault("Date", {})["lt"] = (date_to + timedelta(days=1)).isoformat()
+    if min_amount is not None:
+        ranges.setdefault("Amount", {})["gte"] = min_amount
+    if max_amount is not None:
+        ranges.setdefault("Amount", {})["lte"] = max_amount
+
+    pages = storage.paginate(
+        TRANSACTIONS_INDEX, filters, ranges=ranges, contains={"Description": merchant} if merchant else None,
+        order=order, fields=COLUMNS, page_size=min(EXPORT_PAGE_SIZE, limit or EXPORT_PAGE_SIZE)
+    )
+    try:
+        # Fetch the first page before answering, so a failing backend still gets a 500
+        with timed(f"{storage.name}.export_first_page"):
+            first_page = await anext(pages, [])
+    except Exception as e:
+        logger.exception("Transaction export failed for %s", current_user.username)
+        await pages.aclose()
+        raise HTTPException(status_code=500, detail=str(e))
+    if limit is not None:
+        first_page = first_page[:limit]
+
+    encode = encode_csv if export_format == "csv" else encode_ndjson
+    return StreamingResponse(
+        stream_export(pages, first_page, encode, limit, current_user.username),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="transactions.{export_format}"'}
+    )
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    import serve
+    serve.run()
@@ -0,0 +1,108 @@
+"""
+Request and phase latency metrics, exported in Prometheus text format on /metrics.
+
+MetricsMiddleware records one observation per request, labelled with the route
+template rather than the raw path. Code inside a request wraps its expensive
+steps in `timed("phase")`; phases are also collected per request so requests
+slower than SLOW_REQUEST_SECONDS are logged with their breakdown.
+
+Under several workers (serve.py) each process writes its samples to
+PROMETHEUS_MULTIPROC_DIR and /metrics aggregates all of them, whichever
+worker answers the scrape.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+logger = logging.getLogger(__name__)
+
+# 0 disables slow-request logging
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "1.0"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REQUEST_LATENCY = Histogram(
+    "fincontext_request_duration_seconds",
+    "HTTP request latency by route",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+PHASE_LATENCY = Histogram(
+    "fincontext_phase_duration_seconds",
+    "Latency of individual steps inside requests and ingest jobs",
+    ["phase"],
+    buckets=LATENCY_BUCKETS
+)
+RATE_LIMITED = Counter(
+    "fincontext_rate_limited_total",
+    "Requests refused with 429, by the limit they hit",
+    ["limit"]
+)
+
+_request_phases: ContextVar = ContextVar("request_phases", default=None)
+
+
+def observe_phase(phase: str, seconds: float):
+    PHASE_LATENCY.labels(phase).observe(seconds)
+    phases = _request_phases.get()
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def timed(phase: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_phase(phase, time.perf_counter() - start)
+
+
+def render_metrics():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streaming responses are timed until their last chunk."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        phases = {}
+        token = _request_phases.set(phases)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_phases.reset(token)
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            REQUEST_LATENCY.labels(scope["method"], route_path, str(status_code)).observe(elapsed)
+            if SLOW_REQUEST_SECONDS > 0 and elapsed >= SLOW_REQUEST_SECONDS:
+                breakdown = ", ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in phases.items())
+                logger.warning(
+                    "Slow request: %s %s -> %s in %.1fms [%s]",
+                    scope["method"], scope["path"], status_code, elapsed * 1000, breakdown or "no phases"
+                )
@@ -1,5 +1,6 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional, List
+from sqlalchemy import inspect
 from sqlmodel import SQLModel, Field
 
 class User(SQLModel, table=True):
@@ -19,3 +20,64 @@ class Token(SQLModel):
 
 class TokenData(SQLModel):
     username: Optional[str] = None
+
+class IngestJob(SQLModel, table=True):
+    id: str = Field(primary_key=True)
+    user_id: str = Field(index=True)
+    filename: str
+    file_path: str
+    doc_type: str
+    status: str = Field(default="queued", index=True)
+    rows_processed: int = 0
+    rows_failed: int = 0
+    rows_new: int = 0
+    rows_updated: int = 0
+    rows_skipped: int = 0
+    chunks_processed: int = 0
+    errors: str = "[]"
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class TransactionRollup(SQLModel, table=True):
+    """Running per-user totals by month, category and type, updated as transactions are ingested."""
+    user_id: str = Field(primary_key=True)
+    month: str = Field(primary_key=True)  # "YYYY-MM", "" if the row had no date
+    category: str = Field(primary_key=True)  # "" if the row had no category
+    type: str = Field(primary_key=True)
+    amount_cents: int = 0
+    count: int = 0
+
+class RollupState(SQLModel, table=True):
+    # A row means the user's rollups cover everything in the transactions index
+    user_id: str = Field(primary_key=True)
+    built_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class RateLimitBucket(SQLModel, table=True):
+    """Token bucket shared by all workers when RATE_LIMIT_BACKEND=database; key is "<scope>:<username>"."""
+    key: str = Field(primary_key=True)
+    tokens: float
+    updated_at: float  # unix time of the last refill
+
+class UserDataVersion(SQLModel, table=True):
+    """Bumped by every ingest job that indexed something, so each API worker can tell its caches for the user are stale."""
+    user_id: str = Field(primary_key=True)
+    version: int = 0
+
+def add_missing_columns(engine):
+    """create_all() never alters existing tables, so add columns introduced since they were created."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if isinstance(default, (int, float)):
+                    ddl += f" NOT NULL DEFAULT {default}"
+                conn.exec_driver_sql(ddl)
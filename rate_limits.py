@@ -0,0 +1,184 @@
+"""
+Per-user rate limits and global concurrency caps for the expensive endpoints.
+
+Every user gets a token bucket per scope ("chat", "upload"): up to `burst`
+requests back to back, refilled at `per_minute`. By default the buckets live
+in process memory (MemoryBucketStore), so with several workers each one hands
+out its own budget. RATE_LIMIT_BACKEND=database keeps them in the app
+database instead (DatabaseBucketStore), where every worker takes from the
+same bucket. Anything with the same take() method can be plugged into
+RateLimiter.
+
+ConcurrencyGate caps work in flight in one process, such as upstream agent
+calls. Callers over a limit are refused rather than queued: RateLimitExceeded
+carries the seconds to wait and the API answers 429 with Retry-After.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import RateLimitBucket
+
+# memory | database
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, limit: str, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.limit = limit
+        self.detail = detail
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class BucketLimit:
+    """`burst` tokens, refilled at `per_minute`; either set to 0 turns the limit off."""
+
+    def __init__(self, per_minute: float, burst: int):
+        self.per_minute = per_minute
+        self.burst = burst
+
+    @property
+    def enabled(self) -> bool:
+        return self.per_minute > 0 and self.burst > 0
+
+    @property
+    def rate(self) -> float:
+        return self.per_minute / 60
+
+    def refill(self, tokens: float, elapsed: float) -> float:
+        return min(self.burst, tokens + max(0.0, elapsed) * self.rate)
+
+    def wait(self, tokens: float, cost: float) -> float:
+        return (cost - tokens) / self.rate
+
+
+class MemoryBucketStore:
+    """Buckets in this process only. Idle users are evicted LRU, which at worst hands them a full bucket early."""
+
+    blocking = False
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()  # key -> (tokens, monotonic time of last refill)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: BucketLimit, cost: float = 1.0) -> float:
+        """Takes `cost` tokens; returns 0 if they were there, else the seconds until they will be."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (limit.burst, now))
+            tokens = limit.refill(tokens, now - updated_at)
+            taken = tokens >= cost
+            self._buckets[key] = (tokens - cost if taken else tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return 0.0 if taken else limit.wait(tokens, cost)
+
+
+class DatabaseBucketStore:
+    """Buckets in the app database, shared by every worker (and host) using it.
+
+    Refill and take happen in a single conditional UPDATE, so two workers
+    cannot both spend the last token. Timestamps are wall-clock, so hosts
+    sharing a database need synchronized clocks.
+    """
+
+    blocking = True
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def _insert(self):
+        return (postgresql if self.engine.dialect.name == "postgresql" else sqlite).insert(RateLimitBucket)
+
+    def take(self, key: str, limit: BucketLimit, cost: float = 1.0) -> float:
+        now = time.time()
+        table = RateLimitBucket.__table__
+        smallest = func.least if self.engine.dialect.name == "postgresql" else func.min
+        refilled = smallest(limit.burst, table.c.tokens + (now - table.c.updated_at) * limit.rate)
+        with self.engine.begin() as conn:
+            taken = conn.execute(
+                update(table)
+                .where(table.c.key == key, refilled >= cost)
+                .values(tokens=refilled - cost, updated_at=now)
+            ).rowcount
+            if taken:
+                return 0.0
+            created = conn.execute(
+                self._insert().values(key=key, tokens=limit.burst - cost, updated_at=now)
+                .on_conflict_do_nothing(index_elements=["key"])
+            ).rowcount
+            if created:
+                return 0.0
+            row = conn.execute(select(table.c.tokens, table.c.updated_at).where(table.c.key == key)).first()
+        tokens = limit.refill(row.tokens, now - row.updated_at) if row else 0.0
+        return limit.wait(tokens, cost)
+
+
+def create_bucket_store(backend: Optional[str] = None, engine=None):
+    backend = (backend or RATE_LIMIT_BACKEND).lower()
+    if backend == "memory":
+        return MemoryBucketStore()
+    if backend == "database":
+        if engine is None:
+            raise ValueError("RATE_LIMIT_BACKEND=database needs the app database engine")
+        return DatabaseBucketStore(engine)
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND '{backend}' (expected memory or database)")
+
+
+class RateLimiter:
+    def __init__(self, store, limits: dict):
+        self.store = store
+        self.limits = limits
+
+    def check(self, scope: str, username: str):
+        """Spends one of the user's `scope` tokens, or raises RateLimitExceeded."""
+        limit = self.limits.get(scope)
+        if limit is None or not limit.enabled:
+            return
+        retry_after = self.store.take(f"{scope}:{username}", limit)
+        if retry_after > 0:
+            raise RateLimitExceeded(scope, f"Too many {scope} requests, try again later", retry_after)
+
+
+class Permit:
+    def __init__(self, gate: "ConcurrencyGate"):
+        self._gate = gate
+
+    def release(self):
+        # Safe to call more than once, so every exit path of a stream can release
+        gate, self._gate = self._gate, None
+        if gate is not None:
+            gate._release()
+
+
+class ConcurrencyGate:
+    """At most `limit` holders at a time in this process (0 = no limit); try_acquire never waits."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> Optional[Permit]:
+        with self._lock:
+            if self.limit > 0 and self.in_flight >= self.limit:
+                return None
+            self.in_flight += 1
+        return Permit(self)
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
@@ -0,0 +1,225 @@
+"""
+Per-user transaction rollups by month, category and type, kept in the app database.
+
+Ingest jobs add every indexed chunk to the running totals, so /stats and the
+by-category / monthly-trend analytics read a handful of rows instead of
+aggregating the user's whole history. Users without rollups (data indexed
+before rollups existed, or by the bulk loader) fall back to the storage backend
+until their next upload or a rebuild from the raw index:
+
+    python rollups.py rebuild                 # every user in the index
+    python rollups.py rebuild --user alice    # just these users
+"""
+import argparse
+import logging
+import threading
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+from sqlalchemy import delete
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import SQLModel, Session, select
+
+from database import DATABASE_URL, create_db_engine
+from models import TransactionRollup, RollupState
+from local_analytics import ES_DATE_FORMAT, TRANSACTIONS_INDEX
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_FIELDS = ["user_id", "Date", "Category", "Amount", "Type"]
+UPSERT_BATCH = 500
+
+
+def summarize_frame(df: "pd.DataFrame") -> dict:
+    """Returns {(month, category, type): [amount_cents, count]} for a frame of transactions."""
+    import pandas as pd
+
+    if df.empty:
+        return {}
+    month = pd.to_datetime(df["Date"], errors="coerce").dt.strftime("%Y-%m").fillna("")
+    category = df["Category"].fillna("").astype(str) if "Category" in df else pd.Series("", index=df.index)
+    tx_type = df["Type"].fillna("").astype(str) if "Type" in df else pd.Series("", index=df.index)
+    # Whole cents keep running sums exact however many chunks they are built from
+    cents = (pd.to_numeric(df["Amount"], errors="coerce").fillna(0) * 100).round().astype("int64")
+    grouped = cents.groupby([month, category, tx_type]).agg(["sum", "count"])
+    return {key: [int(total), int(count)] for key, (total, count) in zip(grouped.index, grouped.values)}
+
+
+def merge_totals(into: dict, totals: dict):
+    for key, (cents, count) in totals.items():
+        entry = into.setdefault(key, [0, 0])
+        entry[0] += cents
+        entry[1] += count
+
+
+class RollupStore:
+    def __init__(self, engine):
+        self.engine = engine
+        self._rebuild_lock = threading.Lock()
+
+    def _insert(self):
+        return (postgresql if self.engine.dialect.name == "postgresql" else sqlite).insert(TransactionRollup)
+
+    def _write(self, session: Session, user_id: str, totals: dict):
+        rows = [
+            {"user_id": user_id, "month": month, "category": category, "type": tx_type, "amount_cents": cents, "count": count}
+            for (month, category, tx_type), (cents, count) in totals.items()
+        ]
+        for start in range(0, len(rows), UPSERT_BATCH):
+            stmt = self._insert().values(rows[start:start + UPSERT_BATCH])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["user_id", "month", "category", "type"],
+                set_={
+                    "amount_cents": TransactionRollup.amount_cents + stmt.excluded.amount_cents,
+                    "count": TransactionRollup.count + stmt.excluded.count,
+                }
+            )
+            session.exec(stmt)
+
+    def has_user(self, user_id: str) -> bool:
+        with Session(self.engine) as session:
+            return session.get(RollupState, user_id) is not None
+
+    def add(self, user_id: str, df: "pd.DataFrame"):
+        totals = summarize_frame(df)
+        if not totals:
+            return
+        with Session(self.engine) as session:
+            self._write(session, user_id, totals)
+            session.commit()
+
+    def drop_user(self, user_id: str):
+        with Session(self.engine) as session:
+            session.exec(delete(TransactionRollup).where(TransactionRollup.user_id == user_id))
+            session.exec(delete(RollupState).where(RollupState.user_id == user_id))
+            session.commit()
+
+    def _replace(self, totals_by_user: dict, user_ids=None):
+        # user_ids=None replaces every user's rollups
+        with Session(self.engine) as session:
+            if user_ids is None:
+                session.exec(delete(TransactionRollup))
+                session.exec(delete(RollupState))
+            else:
+                session.exec(delete(TransactionRollup).where(TransactionRollup.user_id.in_(user_ids)))
+                session.exec(delete(RollupState).where(RollupState.user_id.in_(user_ids)))
+            for user_id in (totals_by_user if user_ids is None else user_ids):
+                self._write(session, user_id, totals_by_user.get(user_id, {}))
+                session.add(RollupState(user_id=user_id))
+            session.commit()
+
+    def _scan_totals(self, storage, filters: dict, index_name: str, batch_size: int):
+        import pandas as pd
+
+        totals_by_user, rows = {}, []
+
+        def flush():
+            df = pd.DataFrame(rows, columns=ROLLUP_FIELDS)
+            for user_id, user_rows in df.groupby(df["user_id"].fillna(""), sort=False):
+                if user_id:
+                    merge_totals(totals_by_user.setdefault(user_id, {}), summarize_frame(user_rows))
+
+        for source in storage.scan(index_name, filters, ROLLUP_FIELDS):
+            rows.append(source)
+            if len(rows) >= batch_size:
+                flush()
+                rows = []
+        if rows:
+            flush()
+        return totals_by_user
+
+    def rebuild_user(self, storage, user_id: str, index_name: str = TRANSACTIONS_INDEX, batch_size: int = 10000):
+        totals = self._scan_totals(storage, {"user_id": user_id}, index_name, batch_size)
+        self._replace(totals, [user_id])
+
+    def rebuild_all(self, storage, index_name: str = TRANSACTIONS_INDEX, batch_size: int = 10000):
+        totals = self._scan_totals(storage, {}, index_name, batch_size)
+        self._replace(totals)
+        return len(totals)
+
+    def ensure_user(self, storage, user_id: str, index_name: str = TRANSACTIONS_INDEX):
+        """Builds a user's rollups from the index the first time they ingest."""
+        if self.has_user(user_id):
+            return
+        # Serialized so a second job for the same user cannot add rows before the rebuild lands
+        with self._rebuild_lock:
+            if not self.has_user(user_id):
+                self.rebuild_user(storage, user_id, index_name)
+
+    def _rows(self, user_id: str):
+        with Session(self.engine) as session:
+            return session.exec(select(TransactionRollup).where(TransactionRollup.user_id == user_id)).all()
+
+    def aggregate(self, user_id: str, terms_size: int = 1):
+        """Same shape as storage.aggregate grouped by Type, summing Amount, with top Categories."""
+        groups = {}
+        category_counts = {}
+        for row in self._rows(user_id):
+            if not row.type:
+                continue
+            group = groups.setdefault(row.type, {"sum": 0, "count": 0, "top_terms": []})
+            group["sum"] += row.amount_cents
+            group["count"] += row.count
+            if row.category:
+                counts = category_counts.setdefault(row.type, {})
+                counts[row.category] = counts.get(row.category, 0) + row.count
+        for tx_type, group in groups.items():
+            group["sum"] = group["sum"] / 100
+            ranked = sorted(category_counts.get(tx_type, {}).items(), key=lambda item: (-item[1], item[0]))
+            group["top_terms"] = ranked[:terms_size]
+        return groups
+
+    def query(self, query_type: str, user_id: str, **params):
+        """Rollup-backed versions of the local_analytics expenses and trend queries."""
+        rows = self._rows(user_id)
+        if query_type == "expenses":
+            totals = {}
+            for row in rows:
+                if row.type == "Debit" and row.category:
+                    totals[row.category] = totals.get(row.category, 0) + row.amount_cents
+            ranked = sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+            return [{"total_amount": cents / 100, "Category": category} for category, cents in ranked]
+        if query_type == "trend":
+            totals = {}
+            for row in rows:
+                if row.month and row.type:
+                    totals[(row.month, row.type)] = totals.get((row.month, row.type), 0) + row.amount_cents
+            return [
+                {
+                    "monthly_spend": cents / 100,
+                    "month": datetime.strptime(month, "%Y-%m").strftime(ES_DATE_FORMAT),
+                    "Type": tx_type
+                }
+                for (month, tx_type), cents in sorted(totals.items())
+            ]
+        raise ValueError(f"No rollup query '{query_type}'")
+
+
+if __name__ == "__main__":
+    from storage import create_storage
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    rebuild = subcommands.add_parser("rebuild", help="recompute rollups from the transactions index")
+    rebuild.add_argument("--user", action="append", help="only rebuild this user (repeatable)")
+    rebuild.add_argument("--index", default=TRANSACTIONS_INDEX)
+    rebuild.add_argument("--db", default=DATABASE_URL, help="app database URL (default: DATABASE_URL)")
+    args = parser.parse_args()
+
+    engine = create_db_engine(args.db)
+    SQLModel.metadata.create_all(engine)
+    store = RollupStore(engine)
+    storage = create_storage()
+    try:
+        if args.user:
+            for user_id in args.user:
+                store.rebuild_user(storage, user_id, args.index)
+                logger.info("Rebuilt rollups for %s", user_id)
+        else:
+            logger.info("Rebuilt rollups for %s users", store.rebuild_all(storage, args.index))
+    finally:
+        storage.close()
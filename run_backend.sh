@@ -1,6 +1,7 @@
 #!/bin/bash
-cd /Users/chandanbauri/work/personal/hackathon/fincontext/backend
-source venv/bin/activate
-export ELASTIC_CLOUD_ID=$(grep ELASTIC_CLOUD_ID .env | cut -d '=' -f2)
-export ELASTIC_API_KEY=$(grep ELASTIC_API_KEY .env | cut -d '=' -f2)
-python3 main.py
+# Starts the API with serve.py; arguments are passed through (e.g. --workers 4 --port 8000)
+cd "$(dirname "$0")"
+if [ -f venv/bin/activate ]; then
+    source venv/bin/activate
+fi
+exec python3 serve.py "$@"
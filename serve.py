@@ -0,0 +1,112 @@
+"""
+Production entry point: the API under uvicorn with one worker process per core.
+
+    python serve.py                          # WEB_CONCURRENCY workers, default one per CPU
+    python serve.py --workers 4 --port 8000
+
+Before any worker starts, the supervisor creates and migrates the app database
+once, so workers do not race on CREATE TABLE / ALTER TABLE, and re-queues
+ingest jobs the previous run left "running". Workers only pick up queued jobs. --preload also
+imports the app there to fail fast on configuration errors rather than
+crash-looping every worker. Each worker then opens its own DB pool,
+Elasticsearch and HTTP clients and ingest threads in the app's startup hook.
+
+On SIGTERM/SIGINT uvicorn stops accepting connections and gives in-flight
+requests (uploads still streaming in) GRACEFUL_TIMEOUT seconds. Workers then
+give running ingest jobs INGEST_DRAIN_SECONDS to finish before re-queueing
+them, and close their clients.
+
+With more than one worker, /metrics aggregates all workers through
+PROMETHEUS_MULTIPROC_DIR (a temporary directory unless set).
+Workers keep their own answer, stats and local analytics caches; an ingest in
+one worker bumps the user's data version in the app database, and the others
+drop their cached entries for that user within DATA_VERSION_TTL seconds. ANALYTICS_DIR must
+be on a filesystem all workers share with working flock.
+"""
+import argparse
+import atexit
+import glob
+import os
+import shutil
+import tempfile
+
+from dotenv import load_dotenv
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def env_flag(name: str, default: str = "0") -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
+def prepare_database():
+    from sqlmodel import SQLModel
+
+    import models  # noqa: F401 - registers the tables
+    from database import create_db_engine
+    from ingest_jobs import requeue_running_jobs
+
+    engine = create_db_engine()
+    try:
+        SQLModel.metadata.create_all(engine)
+        models.add_missing_columns(engine)
+        # No worker is running jobs yet, so anything "running" was orphaned by the last run
+        requeue_running_jobs(engine)
+    finally:
+        engine.dispose()
+    # Workers inherit this; one started or respawned later must not take over jobs a live worker is running
+    os.environ["INGEST_RECOVER_RUNNING"] = "0"
+
+
+def prepare_metrics_dir(workers: int):
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if not path:
+        if workers == 1:
+            return
+        path = tempfile.mkdtemp(prefix="fincontext-metrics-")
+        atexit.register(shutil.rmtree, path, ignore_errors=True)
+        # Read by prometheus_client in every worker, so it must be set before they start
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+    os.makedirs(path, exist_ok=True)
+    # Samples from a previous run would be added to this one's
+    for stale in glob.glob(os.path.join(path, "*.db")):
+        os.remove(stale)
+
+
+def run(argv=None):
+    os.chdir(ROOT)
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1)
+    parser.add_argument("--preload", action=argparse.BooleanOptionalAction, default=env_flag("PRELOAD_APP", "1"),
+                        help="import the app in the supervisor before starting workers")
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("GRACEFUL_TIMEOUT", "30")),
+                        help="seconds in-flight requests get to finish on shutdown")
+    parser.add_argument("--keep-alive", type=int, default=int(os.getenv("KEEP_ALIVE", "5")))
+    parser.add_argument("--forwarded-allow-ips", default=os.getenv("FORWARDED_ALLOW_IPS"),
+                        help="proxies trusted for X-Forwarded-* headers")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    prepare_database()
+    prepare_metrics_dir(args.workers)
+    if args.preload:
+        import main  # noqa: F401
+
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        timeout_keep_alive=args.keep_alive,
+        forwarded_allow_ips=args.forwarded_allow_ips,
+    )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,546 @@
+"""
+Storage backends for transactions and documents.
+
+STORAGE_BACKEND selects the implementation:
+- "elasticsearch" (default): the Elastic Cloud cluster, or ELASTIC_URL if set
+- "sqlite": a local SQLite file at STORAGE_SQLITE_PATH
+- "memory": an in-memory SQLite database, for benchmarks and tests
+
+Both expose the same calls: bulk/bulk_encoded/parallel_bulk/index for writes, scan and
+paginate for reads, and term-filtered sum/terms aggregations for /stats.
+"""
+import asyncio
+import json
+import logging
+from contextlib import contextmanager
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    from elasticsearch import Elasticsearch, AsyncElasticsearch
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ELASTIC_CLOUD_ID = os.getenv("ELASTIC_CLOUD_ID")
+ELASTIC_API_KEY = os.getenv("ELASTIC_API_KEY")
+ELASTIC_URL = os.getenv("ELASTIC_URL")
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "elasticsearch")
+STORAGE_SQLITE_PATH = os.getenv("STORAGE_SQLITE_PATH", "fincontext-data.db")
+# How long Elasticsearch keeps a point in time open between two pages of a paginate()
+PIT_KEEP_ALIVE = os.getenv("PIT_KEEP_ALIVE", "2m")
+# After a failed mapping lookup, queries assume the template mapping for this long before trying again
+MAPPING_RETRY_SECONDS = float(os.getenv("MAPPING_RETRY_SECONDS", "30"))
+
+RANGE_OPERATORS = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+
+# The elasticsearch package (with aiohttp) is imported on first use, not at app import
+def create_sync_es_client():
+    from elasticsearch import Elasticsearch
+
+    if ELASTIC_URL:
+        return Elasticsearch(hosts=[ELASTIC_URL], api_key=ELASTIC_API_KEY)
+    return Elasticsearch(
+        cloud_id=ELASTIC_CLOUD_ID,
+        api_key=ELASTIC_API_KEY
+    )
+
+
+def create_async_es_client():
+    from elasticsearch import AsyncElasticsearch
+
+    if ELASTIC_URL:
+        return AsyncElasticsearch(hosts=[ELASTIC_URL], api_key=ELASTIC_API_KEY)
+    return AsyncElasticsearch(
+        cloud_id=ELASTIC_CLOUD_ID,
+        api_key=ELASTIC_API_KEY
+    )
+
+
+class ElasticsearchStorage:
+    name = "elasticsearch"
+
+    def __init__(self, client=None, async_client=None):
+        self._client = client
+        self._async_client = async_client
+        # index -> string fields it maps as text + .keyword, from dynamic mapping before the templates
+        self._text_fields = {}
+        # index -> monotonic time before which a failed mapping lookup is not retried
+        self._mapping_retry_at = {}
+
+    @property
+    def client(self) -> "Elasticsearch":
+        if self._client is None:
+            self._client = create_sync_es_client()
+        return self._client
+
+    @property
+    def async_client(self) -> "AsyncElasticsearch":
+        if self._async_client is None:
+            self._async_client = create_async_es_client()
+        return self._async_client
+
+    def _record_mappings(self, index: str, mappings: dict):
+        text_fields = {
+            field
+            for mapping in mappings.values()
+            for field, spec in mapping["mappings"].get("properties", {}).items()
+            if spec.get("type") == "text" and "keyword" in spec.get("fields", {})
+        }
+        self._text_fields[index] = text_fields
+        return sorted(text_fields)
+
+    def _mapping_failed(self, index: str, error: Exception):
+        self._mapping_retry_at[index] = time.monotonic() + MAPPING_RETRY_SECONDS
+        logger.warning(
+            "Could not read the mapping of %s (%s); assuming the index template's for %ss",
+            index, error, MAPPING_RETRY_SECONDS
+        )
+
+    def _mapping_due(self, index: str) -> bool:
+        return index not in self._text_fields and time.monotonic() >= self._mapping_retry_at.get(index, 0)
+
+    def check_mappings(self, index: str):
+        """Returns the string fields index maps as text, which queries then read through .keyword.
+
+        Indices created before the templates were installed keep their dynamic mapping
+        until `python index_templates.py migrate` re-creates them. A missing index is
+        created from the template on first write, so it has none.
+        """
+        from elasticsearch import NotFoundError
+
+        try:
+            mappings = self.client.indices.get_mapping(index=index)
+        except NotFoundError:
+            mappings = {}
+        except Exception as e:
+            self._mapping_failed(index, e)
+            raise
+        return self._record_mappings(index, mappings)
+
+    async def acheck_mappings(self, index: str):
+        """check_mappings through the async client, for request handlers."""
+        from elasticsearch import NotFoundError
+
+        try:
+            mappings = await self.async_client.indices.get_mapping(index=index)
+        except NotFoundError:
+            mappings = {}
+        except Exception as e:
+            self._mapping_failed(index, e)
+            raise
+        return self._record_mappings(index, mappings)
+
+    def _ensure_mappings(self, index: str):
+        if self._mapping_due(index):
+            try:
+                self.check_mappings(index)
+            except Exception:
+                pass  # logged by _mapping_failed, retried after MAPPING_RETRY_SECONDS
+
+    async def _aensure_mappings(self, index: str):
+        if self._mapping_due(index):
+            try:
+                await self.acheck_mappings(index)
+            except Exception:
+                pass  # logged by _mapping_failed, retried after MAPPING_RETRY_SECONDS
+
+    def _keyword(self, index: str, field: str) -> str:
+        # Only reads what the last mapping lookup found; callers run _ensure_mappings or _aensure_mappings first
+        return f"{field}.keyword" if field in self._text_fields.get(index, ()) else field
+
+    async def keyword_field(self, index: str, field: str) -> str:
+        """The field to filter or aggregate on: field itself, or field.keyword on a legacy dynamic mapping."""
+        await self._aensure_mappings(index)
+        return self._keyword(index, field)
+
+    def _filter_query(self, index: str, filters: dict, ranges=None, contains=None):
+        # String fields are keyword-only in the index templates
+        keyword = lambda field: self._keyword(index, field)
+        clauses = [{"term": {keyword(field): value}} for field, value in filters.items()]
+        clauses += [{"range": {field: bounds}} for field, bounds in (ranges or {}).items()]
+        clauses += [
+            {"wildcard": {keyword(field): {"value": "*" + "".join("\\" + c if c in "*?\\" else c for c in text) + "*"}}}
+            for field, text in (contains or {}).items()
+        ]
+        return {"bool": {"filter": clauses}}
+
+    @staticmethod
+    def _routed(actions):
+        # Route each document by its user so per-user reads hit one shard
+        for action in actions:
+            if "_routing" not in action:
+                user_id = (action.get("doc") or action.get("_source") or {}).get("user_id")
+                if user_id is not None:
+                    action = {**action, "_routing": user_id}
+            yield action
+
+    def bulk(self, actions, chunk_size=500):
+        from elasticsearch import helpers
+
+        return helpers.streaming_bulk(self.client, self._routed(actions), chunk_size=chunk_size, raise_on_error=False)
+
+    def bulk_encoded(self, actions, chunk_size=500):
+        """Like bulk, for (action, source) pairs already encoded as NDJSON bytes, which are sent as they are."""
+        from elasticsearch import helpers
+
+        return helpers.streaming_bulk(
+            self.client, actions, chunk_size=chunk_size, raise_on_error=False, expand_action_callback=lambda pair: pair
+        )
+
+    def parallel_bulk(self, actions, chunk_size=500, thread_count=4):
+        from elasticsearch import helpers
+
+        # Results come back in action order; transport errors are reported per item instead of raised
+        return helpers.parallel_bulk(
+            self.client, self._routed(actions), thread_count=thread_count, chunk_size=chunk_size,
+            raise_on_error=False, raise_on_exception=False
+        )
+
+    @contextmanager
+    def relaxed_index_settings(self, index: str):
+        """Turns off refresh and replicas on index for a backfill, restoring the previous values afterwards."""
+        if not self.client.indices.exists(index=index):
+            self.client.indices.create(index=index)
+        current = self.client.indices.get_settings(index=index, include_defaults=True)[index]
+        previous = {
+            key: current["settings"]["index"].get(key, current["defaults"]["index"].get(key))
+            for key in ("refresh_interval", "number_of_replicas")
+        }
+        self.client.indices.put_settings(index=index, settings={"index": {"refresh_interval": "-1", "number_of_replicas": 0}})
+        try:
+            yield
+        finally:
+            self.client.indices.put_settings(index=index, settings={"index": previous})
+            self.client.indices.refresh(index=index)
+
+    def index(self, index: str, document: dict):
+        self.client.index(index=index, document=document, routing=document.get("user_id"))
+
+    def ensure_mappings(self, index: str, mappings: dict):
+        if self.client.indices.exists(index=index):
+            self.client.indices.put_mapping(index=index, properties=mappings["properties"])
+        else:
+            self.client.indices.create(index=index, mappings=mappings)
+
+    def scan(self, index: str, filters: dict, fields=None):
+        from elasticsearch import NotFoundError, helpers
+
+        self._ensure_mappings(index)
+        body = {"query": self._filter_query(index, filters)}
+        if fields:
+            body["_source"] = list(fields)
+        try:
+            for hit in helpers.scan(self.client, index=index, query=body, routing=filters.get("user_id")):
+                yield hit["_source"]
+        except NotFoundError:
+            return
+
+    async def paginate(self, index: str, filters: dict, ranges=None, contains=None, sort_field="Date",
+                       order="asc", fields=None, page_size=1000):
+        """Yields the matching _source documents a page (list) at a time, ordered by sort_field.
+
+        Pages are read from one point in time with search_after, so documents indexed
+        while a long export runs neither shift nor repeat its pages.
+        """
+        from elasticsearch import NotFoundError
+
+        await self._aensure_mappings(index)
+        try:
+            pit = await self.async_client.open_point_in_time(
+                index=index, keep_alive=PIT_KEEP_ALIVE, routing=filters.get("user_id")
+            )
+        except NotFoundError:
+            return
+        pit_id = pit["id"]
+        search_after = None
+        try:
+            while True:
+                res = await self.async_client.search(
+                    pit={"id": pit_id, "keep_alive": PIT_KEEP_ALIVE},
+                    query=self._filter_query(index, filters, ranges, contains),
+                    sort=[{sort_field: order}, {"_shard_doc": order}],
+                    source=list(fields) if fields else True,
+                    size=page_size,
+                    search_after=search_after,
+                    track_total_hits=False
+                )
+                pit_id = res.get("pit_id", pit_id)
+                hits = res["hits"]["hits"]
+                if not hits:
+                    return
+                yield [hit["_source"] for hit in hits]
+                if len(hits) < page_size:
+                    return
+                search_after = hits[-1]["sort"]
+        finally:
+            await self.async_client.close_point_in_time(id=pit_id)
+
+    def refresh(self, index: str):
+        self.client.indices.refresh(index=index)
+
+    async def aggregate(self, index: str, filters: dict, group_by: str, sum_field: str, terms_field=None, terms_size=1):
+        """Returns {group: {"sum", "count", "top_terms": [(term, count), ...]}} in one request."""
+        await self._aensure_mappings(index)
+        sub_aggs = {"sum": {"sum": {"field": sum_field}}}
+        if terms_field:
+            sub_aggs["top_terms"] = {"terms": {"field": self._keyword(index, terms_field), "size": terms_size}}
+        res = await self.async_client.search(
+            index=index,
+            query=self._filter_query(index, filters),
+            aggs={"groups": {"terms": {"field": self._keyword(index, group_by), "size": 100}, "aggs": sub_aggs}},
+            size=0,
+            routing=filters.get("user_id")
+        )
+        return {
+            bucket["key"]: {
+                "sum": bucket["sum"]["value"] or 0,
+                "count": bucket["doc_count"],
+                "top_terms": [(term["key"], term["doc_count"]) for term in bucket.get("top_terms", {}).get("buckets", [])]
+            }
+            for bucket in res["aggregations"]["groups"]["buckets"]
+        }
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+        self.close()
+
+
+def _json_default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def _encode_source(document: dict) -> str:
+    # SQLite's JSON functions reject NaN, which pandas uses for empty cells
+    clean = {key: None if isinstance(value, float) and math.isnan(value) else value for key, value in document.items()}
+    return json.dumps(clean, default=_json_default)
+
+
+def _json_path(field: str) -> str:
+    return '$."' + field.replace('"', '""') + '"'
+
+
+class SQLiteStorage:
+    """Single-process stand-in for Elasticsearch: one row per document, _source kept as JSON."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = STORAGE_SQLITE_PATH):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "id INTEGER PRIMARY KEY, index_name TEXT NOT NULL, doc_id TEXT, user_id TEXT, source TEXT NOT NULL)"
+            )
+            # Files created before documents had ids
+            if "doc_id" not in {row[1] for row in self._conn.execute("PRAGMA table_info(documents)")}:
+                self._conn.execute("ALTER TABLE documents ADD COLUMN doc_id TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_documents_index_user ON documents (index_name, user_id)")
+            self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_documents_doc_id ON documents (index_name, doc_id)")
+            # Lets paginate() walk a user's transactions in date order a page at a time
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_documents_user_date ON documents "
+                "(index_name, user_id, coalesce(json_extract(source, '$.\"Date\"'), ''), id)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def _where(index: str, filters: dict, ranges=None, contains=None):
+        clauses, params = ["index_name = ?"], [index]
+        for field, value in filters.items():
+            if field == "user_id":
+                clauses.append("user_id = ?")
+                params.append(value)
+            else:
+                clauses.append("json_extract(source, ?) = ?")
+                params.extend([_json_path(field), value])
+        for field, bounds in (ranges or {}).items():
+            for op, value in bounds.items():
+                clauses.append(f"json_extract(source, ?) {RANGE_OPERATORS[op]} ?")
+                params.extend([_json_path(field), value])
+        for field, text in (contains or {}).items():
+            # Case-sensitive, like the wildcard query on the keyword field
+            clauses.append("instr(json_extract(source, ?), ?) > 0")
+            params.extend([_json_path(field), text])
+        return " AND ".join(clauses), params
+
+    def _write(self, op_type: str, index: str, doc_id, source: dict):
+        """Applies one index/update action the way Elasticsearch reports it; call with the lock held."""
+        encoded = _encode_source(source)
+        existing = None
+        if doc_id is not None:
+            existing = self._conn.execute(
+                "SELECT id, source FROM documents WHERE index_name = ? AND doc_id = ?", (index, doc_id)
+            ).fetchone()
+        if existing is None:
+            self._conn.execute(
+                "INSERT INTO documents (index_name, doc_id, user_id, source) VALUES (?, ?, ?, ?)",
+                (index, doc_id, source.get("user_id"), encoded)
+            )
+            return 201, "created"
+        if op_type == "update":
+            # doc_as_upsert: merge into the stored document, and skip the write if nothing changed
+            current = json.loads(existing[1])
+            merged = {**current, **json.loads(encoded)}
+            if merged == current:
+                return 200, "noop"
+            encoded = json.dumps(merged)
+        self._conn.execute(
+            "UPDATE documents SET user_id = ?, source = ? WHERE id = ?", (source.get("user_id"), encoded, existing[0])
+        )
+        return 200, "updated"
+
+    def _apply(self, actions):
+        results = []
+        with self._lock:
+            for action in actions:
+                op_type = action.get("_op_type", "index")
+                doc_id = action.get("_id")
+                try:
+                    status, result = self._write(op_type, action["_index"], doc_id, action["doc"] if op_type == "update" else action["_source"])
+                    results.append((True, {op_type: {"_id": doc_id, "status": status, "result": result}}))
+                except (TypeError, ValueError) as e:
+                    results.append((False, {op_type: {"_id": doc_id, "status": 400, "error": str(e)}}))
+            self._conn.commit()
+        return results
+
+    def bulk(self, actions, chunk_size=500):
+        """Supports "index" (the default) and "update" with a "doc" body, optionally keyed by "_id"."""
+        batch = []
+        for action in actions:
+            batch.append(action)
+            if len(batch) >= chunk_size:
+                yield from self._apply(batch)
+                batch = []
+        if batch:
+            yield from self._apply(batch)
+
+    @staticmethod
+    def _decode_action(action: bytes, source: bytes):
+        (op_type, meta), = json.loads(action).items()
+        body = json.loads(source)
+        decoded = {"_op_type": op_type, "_index": meta["_index"], "_id": meta.get("_id")}
+        decoded.update({"doc": body["doc"]} if op_type == "update" else {"_source": body})
+        return decoded
+
+    def bulk_encoded(self, actions, chunk_size=500):
+        return self.bulk((self._decode_action(action, source) for action, source in actions), chunk_size=chunk_size)
+
+    def parallel_bulk(self, actions, chunk_size=500, thread_count=4):
+        # Writes share one connection, so extra threads would only contend for the lock
+        return self.bulk(actions, chunk_size=chunk_size)
+
+    @contextmanager
+    def relaxed_index_settings(self, index: str):
+        yield
+
+    def index(self, index: str, document: dict):
+        ok, item = self._apply([{"_index": index, "_source": document}])[0]
+        if not ok:
+            raise ValueError(item["index"]["error"])
+
+    def ensure_mappings(self, index: str, mappings: dict):
+        pass
+
+    def scan(self, index: str, filters: dict, fields=None):
+        where, params = self._where(index, filters)
+        with self._lock:
+            rows = self._conn.execute(f"SELECT source FROM documents WHERE {where} ORDER BY id", params).fetchall()
+        for (source,) in rows:
+            doc = json.loads(source)
+            yield {field: doc.get(field) for field in fields} if fields else doc
+
+    def _page(self, index, filters, ranges, contains, sort_key, order, after, page_size):
+        where, params = self._where(index, filters, ranges, contains)
+        direction, compare = ("DESC", "<") if order == "desc" else ("ASC", ">")
+        if after is not None:
+            # The plain bound lets SQLite seek the index to the page start; the row value breaks ties on id
+            where += f" AND {sort_key} {compare}= ? AND ({sort_key}, id) {compare} (?, ?)"
+            params.extend([after[0], *after])
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT {sort_key}, id, source FROM documents WHERE {where} "
+                f"ORDER BY {sort_key} {direction}, id {direction} LIMIT ?",
+                [*params, page_size]
+            ).fetchall()
+
+    async def paginate(self, index: str, filters: dict, ranges=None, contains=None, sort_field="Date",
+                       order="asc", fields=None, page_size=1000):
+        """Keyset pagination on (sort_field, id); each page is one short query, so writes are not blocked between pages."""
+        # Written the way ix_documents_user_date indexes it, so Date-ordered pages come straight off the index
+        sort_key = f"coalesce(json_extract(source, '{_json_path(sort_field)}'), '')"
+        after = None
+        while True:
+            rows = await asyncio.to_thread(self._page, index, filters, ranges, contains, sort_key, order, after, page_size)
+            if not rows:
+                return
+            docs = [json.loads(source) for _, _, source in rows]
+            yield [{field: doc.get(field) for field in fields} for doc in docs] if fields else docs
+            if len(rows) < page_size:
+                return
+            after = rows[-1][:2]
+
+    def refresh(self, index: str):
+        pass
+
+    def _aggregate(self, index, filters, group_by, sum_field, terms_field, terms_size):
+        where, params = self._where(index, filters)
+        with self._lock:
+            groups = self._conn.execute(
+                f"SELECT json_extract(source, ?) AS grp, SUM(json_extract(source, ?)), COUNT(*) "
+                f"FROM documents WHERE {where} GROUP BY grp",
+                [_json_path(group_by), _json_path(sum_field), *params]
+            ).fetchall()
+            result = {}
+            for group, total, count in groups:
+                if group is None:
+                    continue
+                top_terms = []
+                if terms_field:
+                    top_terms = self._conn.execute(
+                        f"SELECT json_extract(source, ?) AS term, COUNT(*) AS n FROM documents "
+                        f"WHERE {where} AND json_extract(source, ?) = ? AND term IS NOT NULL "
+                        f"GROUP BY term ORDER BY n DESC, term ASC LIMIT ?",
+                        [_json_path(terms_field), *params, _json_path(group_by), group, terms_size]
+                    ).fetchall()
+                result[group] = {"sum": total or 0, "count": count, "top_terms": [tuple(term) for term in top_terms]}
+        return result
+
+    async def aggregate(self, index: str, filters: dict, group_by: str, sum_field: str, terms_field=None, terms_size=1):
+        return await asyncio.to_thread(self._aggregate, index, filters, group_by, sum_field, terms_field, terms_size)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    async def aclose(self):
+        self.close()
+
+
+def create_storage(backend: str = STORAGE_BACKEND):
+    if backend == "elasticsearch":
+        return ElasticsearchStorage()
+    if backend == "sqlite":
+        return SQLiteStorage(STORAGE_SQLITE_PATH)
+    if backend == "memory":
+        return SQLiteStorage(":memory:")
+    raise ValueError(f"Unknown STORAGE_BACKEND '{backend}'")
@@ -0,0 +1,211 @@
+"""
+Fast path for transaction CSVs with the Date, Description, Category, Amount, Type
+schema written by generate_user_data.py and generate_dummy_data.py.
+
+Columns are read with explicit dtypes (Category and Type as categoricals) and
+Date with a fixed YYYY-MM-DD format instead of per-value inference. Rows that
+do not fit the schema are rejected with their line number rather than failing
+the upload. Bulk actions are encoded straight to NDJSON bytes, which the
+Elasticsearch client sends as-is instead of serializing a dict per row.
+"""
+import csv
+import json
+import re
+import threading
+import warnings
+
+import numpy as np
+import pandas as pd
+
+TRANSACTION_COLUMNS = ["Date", "Description", "Category", "Amount", "Type"]
+TRANSACTION_TYPES = ("Debit", "Credit")
+DATE_FORMAT = "%Y-%m-%d"
+# Amount is read as text so one bad value rejects its row instead of the chunk
+READ_DTYPES = {"Date": str, "Description": str, "Category": "category", "Amount": str, "Type": "category"}
+# Only empty fields are missing, on this path and the generic one: "NA" or "null" is a real
+# Description, and both paths must hash it the same way
+READ_OPTIONS = {"keep_default_na": False, "na_values": [""], "skip_blank_lines": False}
+
+_SKIPPED_LINE_RE = re.compile(r"Skipping line (\d+): ([^\n]+)")
+# warnings.catch_warnings is process-wide, so concurrent ingest jobs take turns reading chunks
+_read_lock = threading.Lock()
+
+
+def has_transaction_schema(file_path) -> bool:
+    with open(file_path, newline="", encoding="utf-8") as f:
+        header = next(csv.reader(f), [])
+    return len(header) == len(TRANSACTION_COLUMNS) and set(header) == set(TRANSACTION_COLUMNS)
+
+
+def _next_chunk(reader):
+    """Reads the next chunk, with the (line, error) of malformed lines the C parser skipped."""
+    with _read_lock, warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always", pd.errors.ParserWarning)
+        chunk = next(reader, None)
+    malformed = []
+    for warning in caught:
+        if issubclass(warning.category, pd.errors.ParserWarning):
+            malformed.extend((int(line), error) for line, error in _SKIPPED_LINE_RE.findall(str(warning.message)))
+        else:
+            warnings.warn_explicit(warning.message, warning.category, warning.filename, warning.lineno)
+    return chunk, malformed
+
+
+def _line_numbers(first_line: int, rows: int, skipped) -> np.ndarray:
+    lines = np.arange(first_line, first_line + rows, dtype=np.int64)
+    for line in sorted(skipped):
+        lines[lines >= line] += 1
+    return lines
+
+
+def blank_rows(chunk: pd.DataFrame) -> np.ndarray:
+    """Rows read from empty or whitespace-only lines, which pandas keeps when skip_blank_lines=False."""
+    blank = chunk.iloc[:, 1:].isna().all(axis=1).to_numpy(copy=True)
+    if blank.any():
+        first = chunk.iloc[:, 0][blank]
+        blank[blank] = (first.isna() | first.astype(str).str.strip().eq("")).to_numpy()
+    return blank
+
+
+def embedded_newlines(chunk: pd.DataFrame) -> np.ndarray:
+    """Newlines inside quoted fields, per row. pandas numbers lines by record, so each one shifts later lines."""
+    counts = np.zeros(len(chunk), dtype=np.int64)
+    for _, values in chunk.items():
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            per_category = np.append(values.cat.categories.astype(str).str.count("\n").to_numpy(dtype=np.int64), 0)
+            counts += per_category[values.cat.codes.to_numpy()]  # code -1 (missing) picks the trailing 0
+        elif pd.api.types.is_string_dtype(values.dtype):
+            counts += values.str.count("\n").fillna(0).to_numpy(dtype=np.int64)
+    return counts
+
+
+def has_quotes(file_path, block_size=1 << 20) -> bool:
+    """Whether any field is quoted; without quotes no field can hold a newline."""
+    with open(file_path, "rb") as f:
+        while block := f.read(block_size):
+            if b'"' in block:
+                return True
+    return False
+
+
+def file_lines(record_lines: np.ndarray, chunk: pd.DataFrame, offset: int, quoted: bool = True):
+    """Maps pandas' record line numbers to lines in the file.
+
+    offset is the number of embedded newlines in earlier chunks; quoted=False
+    (see has_quotes) skips counting them. Returns the lines, the newlines before
+    each row plus offset (for placing skipped lines) and the offset for the next chunk.
+    """
+    if not quoted:
+        return record_lines, np.full(len(record_lines), offset, dtype=np.int64), offset
+    newlines = embedded_newlines(chunk)
+    before = np.cumsum(newlines) - newlines + offset
+    return record_lines + before, before, offset + int(newlines.sum())
+
+
+def _validate(chunk: pd.DataFrame, lines: np.ndarray):
+    """Returns (dates, amounts, bad row mask, rejects); each rejected row reports its first problem."""
+    dates = pd.to_datetime(chunk["Date"], format=DATE_FORMAT, errors="coerce")
+    amounts = pd.to_numeric(chunk["Amount"].to_numpy(dtype=object), errors="coerce").astype("float64")
+    checks = [
+        ("Date must be YYYY-MM-DD", dates.isna().to_numpy()),
+        ("missing Description", chunk["Description"].isna().to_numpy()),
+        ("missing Category", chunk["Category"].isna().to_numpy()),
+        ("Amount must be a number", ~np.isfinite(amounts)),
+        ("Type must be Debit or Credit", ~chunk["Type"].isin(TRANSACTION_TYPES).to_numpy()),
+    ]
+    bad = np.zeros(len(chunk), dtype=bool)
+    rejects = []
+    for error, failed in checks:
+        failed = failed & ~bad
+        rejects.extend({"line": int(line), "error": error} for line in lines[failed])
+        bad |= failed
+    return dates, amounts, bad, rejects
+
+
+def read_transaction_chunks(file_path, chunk_size, user_id=None):
+    """Yields (frame, dates, lines, rejects) for each chunk of a schema CSV.
+
+    frame holds the chunk's valid rows: Date as datetime64, Amount as float64, Category
+    and Type as categoricals, plus user_id when given. dates are the same dates as
+    YYYY-MM-DD strings and lines the line of the file each row starts on, counting
+    blank lines and newlines inside quoted fields. rejects lists {"line", "error"}
+    for the rows left out; a malformed line is placed from the rows read around it,
+    so one that itself spans several lines shifts the lines reported after it.
+    """
+    reader = pd.read_csv(
+        file_path, chunksize=chunk_size, encoding="utf-8", dtype=READ_DTYPES, on_bad_lines="warn", **READ_OPTIONS
+    )
+    next_line = 2  # line 1 is the header
+    offset = 0
+    quoted = has_quotes(file_path)
+    with reader:
+        while True:
+            chunk, malformed = _next_chunk(reader)
+            if chunk is None and not malformed:
+                return
+            if chunk is None:
+                chunk = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in READ_DTYPES.items()})
+            record_lines = _line_numbers(next_line, len(chunk), [line for line, _ in malformed])
+            next_line = max([next_line - 1, *record_lines[-1:], *(line for line, _ in malformed)]) + 1
+            lines, before, next_offset = file_lines(record_lines, chunk, offset, quoted)
+            skipped_before = np.append(before, next_offset)
+            malformed = [
+                (line + int(skipped_before[np.searchsorted(record_lines, line)]), error) for line, error in malformed
+            ]
+            offset = next_offset
+
+            blank = blank_rows(chunk)
+            if blank.any():
+                chunk, lines = chunk[~blank], lines[~blank]
+            dates, amounts, bad, rejects = _validate(chunk, lines)
+            rejects.extend({"line": line, "error": error} for line, error in malformed)
+            keep = ~bad
+            frame = pd.DataFrame({
+                "Date": dates.to_numpy()[keep],
+                "Description": chunk["Description"].to_numpy()[keep],
+                "Category": chunk["Category"].array[keep].remove_unused_categories(),
+                "Amount": amounts[keep],
+                "Type": chunk["Type"].array[keep].remove_unused_categories(),
+            })
+            if user_id is not None:
+                frame["user_id"] = user_id
+            day_strings = np.datetime_as_string(frame["Date"].to_numpy().astype("datetime64[D]"), unit="D")
+            yield frame, day_strings, lines[keep], sorted(rejects, key=lambda reject: reject["line"])
+
+
+def json_amount(amount):
+    """Whole amounts as ints, as pandas reads an all-integer Amount column.
+
+    Elasticsearch compares sources by value type, so 250 -> 250.0 counts as an
+    update rather than a noop; every path writes whole amounts the same way.
+    """
+    return int(amount) if isinstance(amount, float) and amount.is_integer() else amount
+
+
+def _json_values(values) -> np.ndarray:
+    """JSON-encodes each distinct value once; returns the encoded string for every row."""
+    codes, uniques = pd.factorize(values)
+    return np.array([json.dumps(str(value)) for value in uniques], dtype=object)[codes]
+
+
+def encode_update_actions(index_name: str, ids, frame: pd.DataFrame, dates, user_id=None):
+    """Returns one (action, source) pair of NDJSON bytes per row: an update with doc_as_upsert, routed by user_id.
+
+    The documents match what the dict path sends for the same rows (Date as YYYY-MM-DDT00:00:00).
+    """
+    meta = f'"_index":{json.dumps(index_name)}'
+    user_field = ""
+    if user_id is not None:
+        meta += f',"routing":{json.dumps(user_id)}'
+        user_field = f',"user_id":{json.dumps(user_id)}'
+    return [
+        (
+            f'{{"update":{{{meta},"_id":"{doc_id}"}}}}'.encode(),
+            (f'{{"doc":{{"Date":"{date}T00:00:00","Description":{description},"Category":{category},'
+             f'"Amount":{json_amount(amount)!r},"Type":{tx_type}{user_field}}},"doc_as_upsert":true}}').encode()
+        )
+        for doc_id, date, description, category, amount, tx_type in zip(
+            ids, dates, _json_values(frame["Description"]), _json_values(frame["Category"]),
+            frame["Amount"].tolist(), _json_values(frame["Type"])
+        )
+    ]